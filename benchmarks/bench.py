@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+"""
+Run the synctools benchmark suite and store the results as JSON.
+
+Each benchmark runs against a freshly generated synthetic library (see
+benchmarks/generate.py), so results are comparable between versions as long
+as the profile and seed are the same. Run from the repository root:
+
+    python -m benchmarks.bench
+    python -m benchmarks.bench --compare benchmarks/results/0.9.0.json
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+from simfile import Simfile
+
+from synctools import __version__, batch, settings, utils
+from benchmarks.generate import generate_library, profiles
+
+__all__ = ['benchmarks', 'run_benchmarks']
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+
+def default_options(spec):
+    return dict((field['name'], field['default']) for field in spec.fields)
+
+
+def bench_discovery(library, paths):
+    list(utils.iter_simfiles(library))
+
+def bench_parse(library, paths):
+    for path in paths:
+        Simfile(path)
+
+def command_benchmark(name):
+    def bench_command(library, paths):
+        spec = utils.get_command_specs()[name]
+        command_instance = spec.load()(default_options(spec))
+        batch.run_serial(command_instance, paths)
+    bench_command.__name__ = 'bench_' + name.lower()
+    return bench_command
+
+
+def benchmarks():
+    """
+    Return a list of (name, profile name, function) tuples. Each function
+    takes the library's root directory and its list of simfile paths.
+    """
+    suite = []
+    for profile in ('small', 'library'):
+        suite.append(('discovery', profile, bench_discovery))
+        suite.append(('parse', profile, bench_parse))
+    suite.append(('parse', 'dense', bench_parse))
+    suite.append(('parse', 'gimmick', bench_parse))
+    for name in sorted(utils.get_command_specs()):
+        for profile in ('small', 'dense', 'gimmick', 'marathon'):
+            suite.append((name, profile, command_benchmark(name)))
+    return suite
+
+
+def run_benchmarks(selected=None, repeat=3, seed=0):
+    """
+    Run the benchmarks whose names are in `selected` (or all of them) and
+    return a dict of results. Each benchmark is timed `repeat` times against
+    a fresh copy of its library.
+    """
+    results = {}
+    workdir = tempfile.mkdtemp(prefix='synctools-bench-')
+    # Keep the user's journal and index out of this
+    settings.JOURNAL_PATH = os.path.join(workdir, 'journal.jsonl')
+    settings.INDEX_PATH = os.path.join(workdir, 'index.db')
+    try:
+        libraries = {}
+        for name, profile, function in benchmarks():
+            if selected and name not in selected:
+                continue
+            if profile not in libraries:
+                source = os.path.join(workdir, 'source-' + profile)
+                generate_library(source, profiles[profile], seed)
+                libraries[profile] = source
+            times = []
+            for i in xrange(repeat):
+                library = os.path.join(workdir, 'run')
+                shutil.copytree(libraries[profile], library)
+                paths = sorted(utils.iter_simfiles(library))
+                start = time.time()
+                function(library, paths)
+                times.append(time.time() - start)
+                shutil.rmtree(library)
+            key = '%s/%s' % (name, profile)
+            times.sort()
+            results[key] = {
+                'min': times[0],
+                'median': times[len(times) // 2],
+                'max': times[-1],
+                'simfiles': profiles[profile].songs,
+            }
+            print '%-32s %8.3fs' % (key, times[0])
+    finally:
+        shutil.rmtree(workdir)
+    return results
+
+
+def compare(results, baseline):
+    """
+    Print the ratio between each result's best time and the baseline's.
+    """
+    for key in sorted(results):
+        if key not in baseline['results']:
+            continue
+        old = baseline['results'][key]['min']
+        new = results[key]['min']
+        ratio = new / old if old else float('inf')
+        flag = '  <-- slower' if ratio > 1.1 else ''
+        print '%-32s %8.3fs -> %8.3fs (%.2fx)%s' % (key, old, new, ratio,
+                                                    flag)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('benchmarks', nargs='*',
+                        help='names of benchmarks to run (default: all)')
+    parser.add_argument('-r', '--repeat', type=int, default=3)
+    parser.add_argument('-s', '--seed', type=int, default=0)
+    parser.add_argument('-o', '--output',
+                        help='where to write the results (default: '
+                             'benchmarks/results/<version>.json)')
+    parser.add_argument('-c', '--compare', metavar='JSON',
+                        help='compare against previously stored results')
+    args = parser.parse_args()
+
+    # Command output would drown out the results
+    logging.getLogger('synctools').setLevel(logging.ERROR)
+    logging.getLogger('synctools').addHandler(logging.StreamHandler())
+
+    results = run_benchmarks(args.benchmarks, args.repeat, args.seed)
+    output = args.output or os.path.join(RESULTS_DIR, __version__ + '.json')
+    if not os.path.isdir(os.path.dirname(os.path.abspath(output))):
+        os.makedirs(os.path.dirname(os.path.abspath(output)))
+    with open(output, 'w') as output_file:
+        json.dump({
+            'version': __version__,
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'seed': args.seed,
+            'profiles': dict((name, profile.to_dict())
+                             for name, profile in profiles.items()),
+            'results': results,
+        }, output_file, indent=4, sort_keys=True)
+    print 'Results written to %s' % output
+
+    if args.compare:
+        with open(args.compare) as baseline:
+            compare(results, json.load(baseline))
+
+if __name__ == '__main__':
+    main()
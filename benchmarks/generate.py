@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+"""
+Generate synthetic simfiles and libraries for benchmarking.
+
+Every dimension that affects synctools' performance can be tuned: number of
+songs, charts per song, note density, number of BPM changes and stops, song
+length and the size of gimmicks.txt. Output is fully determined by the seed.
+"""
+import argparse
+import os
+import random
+import struct
+
+__all__ = ['Profile', 'generate_simfile', 'generate_gimmicks',
+           'generate_ogg', 'generate_library', 'profiles']
+
+STEPSTYPES = ('dance-single', 'dance-double', 'pump-single')
+DIFFICULTIES = ('Challenge', 'Hard', 'Medium', 'Easy', 'Beginner', 'Edit')
+
+class Profile(object):
+    """
+    The shape of a synthetic library.
+
+        * `songs` -- number of song folders
+        * `packs` -- number of pack folders the songs are spread across
+        * `charts` -- charts per song
+        * `measures` -- song length in measures
+        * `density` -- probability that any given 16th note row has a note
+        * `mines` -- probability that a note is a mine rather than a tap
+        * `bpms` -- number of BPM changes per song
+        * `stops` -- number of stops per song
+        * `gimmicks` -- number of gimmick lines in each gimmicks.txt
+    """
+
+    def __init__(self, songs=10, packs=1, charts=1, measures=64, density=.25,
+                 mines=.05, bpms=4, stops=4, gimmicks=16):
+        self.songs = songs
+        self.packs = packs
+        self.charts = charts
+        self.measures = measures
+        self.density = density
+        self.mines = mines
+        self.bpms = bpms
+        self.stops = stops
+        self.gimmicks = gimmicks
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+
+# Named profiles used by the benchmark suite
+profiles = {
+    'small': Profile(),
+    'library': Profile(songs=200, packs=10, charts=5),
+    'dense': Profile(songs=5, charts=3, density=1.),
+    'gimmick': Profile(songs=5, measures=400, bpms=2000, stops=2000,
+                       gimmicks=1000),
+    'marathon': Profile(songs=2, measures=600),
+}
+
+
+def _timing(rng, count, beats, value):
+    """
+    Generate `count` sorted "beat=value" pairs on 192nd-note positions.
+    """
+    positions = sorted(rng.sample(xrange(1, beats * 48), min(count,
+                                                            beats * 48 - 1)))
+    return ',\n'.join('%.3f=%.3f' % (position / 48., value(rng))
+                      for position in positions)
+
+
+def _notes(rng, profile, columns):
+    measures = []
+    for measure in xrange(profile.measures):
+        rows = []
+        for row in xrange(16):
+            line = ['0'] * columns
+            if rng.random() < profile.density:
+                column = rng.randrange(columns)
+                line[column] = 'M' if rng.random() < profile.mines else '1'
+            rows.append(''.join(line))
+        measures.append('\n'.join(rows))
+    return '\n,\n'.join(measures)
+
+
+def generate_simfile(rng, profile, title='Untitled'):
+    """
+    Return the text of a synthetic .sm file.
+    """
+    beats = profile.measures * 4
+    bpm = rng.choice((120, 140, 150, 174, 180, 200))
+    bpms = '0.000=%.3f' % bpm
+    if profile.bpms:
+        bpms += ',\n' + _timing(rng, profile.bpms, beats,
+                                lambda rng: rng.uniform(bpm / 2, bpm * 2))
+    stops = _timing(rng, profile.stops, beats,
+                    lambda rng: 60. / bpm / 48 * rng.randint(1, 96))
+    lines = [
+        '#TITLE:%s;' % title,
+        '#SUBTITLE:;',
+        '#ARTIST:synctools benchmark;',
+        '#CREDIT:benchmarks/generate.py;',
+        '#MUSIC:song.ogg;',
+        '#OFFSET:%.3f;' % rng.uniform(-.1, .1),
+        '#SAMPLESTART:0.000;',
+        '#SAMPLELENGTH:10.000;',
+        '#BPMS:%s;' % bpms,
+        '#STOPS:%s;' % stops,
+    ]
+    for chart in xrange(profile.charts):
+        stepstype = STEPSTYPES[chart // len(DIFFICULTIES) % len(STEPSTYPES)]
+        difficulty = DIFFICULTIES[chart % len(DIFFICULTIES)]
+        columns = 8 if stepstype == 'dance-double' else (
+            5 if stepstype.startswith('pump') else 4)
+        lines.append('\n//---------------%s - ----------------' % stepstype)
+        lines.append('#NOTES:\n     %s:\n     :\n     %s:\n     %s:\n'
+                     '     0,0,0,0,0:\n%s\n;' % (
+                         stepstype, difficulty, rng.randint(1, 15),
+                         _notes(rng, profile, columns)))
+    return '\n'.join(lines) + '\n'
+
+
+def generate_gimmicks(rng, profile):
+    """
+    Return the text of a synthetic version 0.2.0 gimmicks.txt file.
+    """
+    bpm = rng.choice((120, 140, 150, 174, 180, 200))
+    lines = ['version: 0.2.0', '', 'gimmicks:', '    0: bpm %s' % bpm]
+    beat = 4.
+    beats = profile.measures * 4
+    for i in xrange(profile.gimmicks):
+        if beat >= beats:
+            break
+        kind = rng.random()
+        if kind < .1:
+            lines.append('    %s: bpm %s' % (beat, rng.choice((
+                bpm / 2, bpm, bpm * 2))))
+            beat += 1
+        elif kind < .2:
+            lines.append('    %s: stop 1/%s' % (beat, rng.choice((4, 8))))
+            beat += 1
+        elif kind < .3 and beat >= 12:
+            lines.append('    %s-%s: copy %s' % (beat, beat + 4, beat - 8))
+            beat += 4
+        else:
+            name = rng.choice(('stutter', 'midstutter', 'halfbrake',
+                               'quarterbrake', 'halfboost', 'quarterboost'))
+            length = rng.choice(('1/4', '1/8', '1/16'))
+            mul = rng.choice(('1.5x', '2x', '3x'))
+            lines.append('    %s-%s: %s %s %s' % (beat, beat + 2, length, mul,
+                                                  name))
+            beat += 2
+    return '\n'.join(lines) + '\n'
+
+
+def generate_ogg(rng, size=65536, seconds=120):
+    """
+    Return the bytes of a stand-in OGG file: random data followed by a valid
+    last page header, which is all the Patch command looks at.
+    """
+    body = ''.join(chr(rng.randrange(256)) for i in xrange(size))
+    # Avoid accidental capture patterns in the filler
+    body = body.replace('OggS', 'Ogg_')
+    payload = ''.join(chr(rng.randrange(256)) for i in xrange(255))
+    page = ('OggS\x00\x04' + struct.pack('<q', seconds * 44100) +
+            struct.pack('<II', 1, 2) + '\x00' * 4 + '\x01\xff' + payload)
+    return body + page
+
+
+def generate_library(root, profile, seed=0, gimmicks=True, audio=True):
+    """
+    Write a synthetic library of song folders under `root`, organized as
+    pack/song/song.sm. Returns the list of simfile paths.
+    """
+    rng = random.Random(seed)
+    paths = []
+    for song in xrange(profile.songs):
+        pack = 'Pack %02d' % (song % max(profile.packs, 1))
+        song_dir = os.path.join(root, pack, 'Song %04d' % song)
+        if not os.path.isdir(song_dir):
+            os.makedirs(song_dir)
+        path = os.path.join(song_dir, 'song.sm')
+        with open(path, 'w') as simfile:
+            simfile.write(generate_simfile(rng, profile, 'Song %04d' % song))
+        if gimmicks:
+            with open(os.path.join(song_dir, 'gimmicks.txt'), 'w') as gfile:
+                gfile.write(generate_gimmicks(rng, profile))
+        if audio:
+            with open(os.path.join(song_dir, 'song.ogg'), 'wb') as ogg:
+                ogg.write(generate_ogg(rng))
+        paths.append(path)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('root', help='directory to write the library to')
+    parser.add_argument('-p', '--profile', choices=sorted(profiles),
+                        default='small', help='base library profile')
+    parser.add_argument('-s', '--seed', type=int, default=0)
+    for name, value in sorted(Profile().to_dict().items()):
+        parser.add_argument('--' + name, type=type(value),
+                            help='override the profile (default for "small": '
+                                 '%s)' % value)
+    args = parser.parse_args()
+    profile = Profile(**profiles[args.profile].to_dict())
+    for name in profile.to_dict():
+        if getattr(args, name) is not None:
+            setattr(profile, name, getattr(args, name))
+    paths = generate_library(args.root, profile, args.seed)
+    print 'Generated %s simfiles in %s' % (len(paths), args.root)
+
+if __name__ == '__main__':
+    main()
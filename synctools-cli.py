@@ -1,5 +1,8 @@
 #!/usr/bin/env python
+import multiprocessing
+
 from synctools.cli import main
 
 if __name__ == "__main__":
+   multiprocessing.freeze_support()
    main()
\ No newline at end of file
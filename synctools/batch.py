@@ -0,0 +1,306 @@
+import logging
+import multiprocessing
+import os
+import time
+import traceback
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+from simfile import Simfile
+
+from synctools.manifest import RunManifest
+
+__all__ = ['run_batch', 'run_serial', 'run_parallel', 'watch']
+
+class RecordBuffer(logging.Handler):
+    """
+    Holds log records in memory so that a worker process can hand them back
+    to the main process in one piece.
+    """
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        # Flatten the record so that it survives pickling
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(
+                record.exc_info)
+            record.exc_info = None
+        record.msg = record.getMessage()
+        record.args = None
+        self.records.append(record)
+
+
+def _log_error(log, path):
+    """
+    Log the exception being handled as an error for the given simfile, with
+    the traceback at debug level.
+    """
+    tb_lines = traceback.format_exc().splitlines()
+    for line in tb_lines[:-1]:
+        log.debug(line)
+    log.error('%s: %s' % (path, tb_lines[-1]))
+
+
+# State of the current worker process, set up by _init_worker
+_worker = {}
+
+def _init_worker(Command, args, run_id, level, manifest_filename, force):
+    # Replace any handlers inherited from the parent process; everything
+    # logged in here is buffered and emitted by the parent instead
+    log = logging.getLogger('synctools')
+    for handler in log.handlers[:]:
+        log.removeHandler(handler)
+    log.setLevel(level)
+    buffer = RecordBuffer()
+    log.addHandler(buffer)
+    _worker['log'] = log
+    _worker['buffer'] = buffer
+    _worker['command'] = Command(*args)
+    # Journal changes under the parent's run ID
+    _worker['command'].run_id = run_id
+    # Workers only read from the manifest; the parent records the results
+    _worker['manifest'] = (manifest_filename and
+                           RunManifest(manifest_filename))
+    _worker['force'] = force
+
+def _run_worker(path):
+    buffer = _worker['buffer']
+    del buffer.records[:]
+    command_instance = _worker['command']
+    state = result = None
+    ok = True
+    try:
+        if _worker['manifest']:
+            state = _worker['manifest'].check(command_instance, path,
+                                              _worker['force'])
+            # Don't hold on to the write lock taken by index updates
+            _worker['manifest'].commit()
+            if state is None:
+                return path, [], None, ok, state
+        result = command_instance.run(Simfile(path))
+    except Exception:
+        ok = False
+        _log_error(_worker['log'], path)
+    return path, buffer.records[:], result, ok, state
+
+
+def run_serial(command_instance, paths, manifest=None, force=False,
+               profiler=None):
+    """
+    Run the command on each simfile path in turn, then call done() unless
+    the command is `watching`, in which case watch() calls it later. A
+    simfile that raises an error, whether in the command or while checking
+    or recording it in the manifest, is logged and skipped, and isn't
+    recorded in the manifest.
+
+    If a RunManifest is given, simfiles that are unchanged since the command
+    last ran on them with the same options are skipped unless `force` is
+    True, and every processed simfile is recorded. If a Profiler is given,
+    each simfile's parsing and the command's phases are timed.
+    """
+    load = Simfile
+    if profiler:
+        profiler.instrument(command_instance)
+        load = profiler.timed('parse', Simfile)
+    skipped = 0
+    for path in paths:
+        try:
+            # Checking hashes the simfile, which may be unreadable
+            if manifest:
+                state = manifest.check(command_instance, path, force)
+                if state is None:
+                    skipped += 1
+                    continue
+            if profiler:
+                profiler.start(path)
+            try:
+                result = command_instance.run(load(path))
+            finally:
+                # Even KeyboardInterrupt shouldn't leave a simfile
+                # half-recorded
+                if profiler:
+                    profiler.stop()
+        except Exception:
+            # Carry on with the next simfile, as run_parallel does
+            _log_error(command_instance.log, path)
+            continue
+        command_instance.collect(result)
+        if manifest:
+            try:
+                manifest.record(command_instance, path, state)
+            except Exception:
+                _log_error(command_instance.log, path)
+    if skipped:
+        command_instance.log.info('Skipped %s unchanged simfiles' % skipped)
+    if not command_instance.watching:
+        command_instance.done()
+
+
+def run_parallel(command_instance, paths, jobs, manifest=None, force=False):
+    """
+    Spread the simfile paths across `jobs` worker processes, each of which
+    creates its own instance of the command from its init_args().
+
+    Log records are buffered per simfile and emitted by this process once the
+    simfile is finished, so output from different songs never interleaves.
+    The value returned by each run() is passed to `command_instance.collect`,
+    followed by a single call to `command_instance.done` (left to watch()
+    if the command is `watching`). The manifest is handled as in run_serial,
+    except that simfiles which raised an error are not recorded.
+    """
+    log = logging.getLogger('synctools')
+    pool = multiprocessing.Pool(jobs, _init_worker, (
+        type(command_instance),
+        command_instance.init_args(),
+        command_instance.run_id,
+        log.getEffectiveLevel(),
+        manifest and manifest.filename,
+        force,
+    ))
+    skipped = 0
+    try:
+        for path, records, result, ok, state in pool.imap_unordered(
+                _run_worker, paths):
+            if manifest and ok and state is None:
+                skipped += 1
+                continue
+            for record in records:
+                log.handle(record)
+            command_instance.collect(result)
+            if manifest and ok:
+                try:
+                    manifest.record(command_instance, path, state)
+                except Exception:
+                    _log_error(log, path)
+    except BaseException:
+        # Don't wait for the rest of the queued simfiles
+        pool.terminate()
+        pool.join()
+        raise
+    pool.close()
+    pool.join()
+    if skipped:
+        command_instance.log.info('Skipped %s unchanged simfiles' % skipped)
+    if not command_instance.watching:
+        command_instance.done()
+
+
+def run_batch(command_instance, paths, jobs=1, manifest=None, force=False,
+              profiler=None):
+    """
+    Run the command over the given simfile paths, using `jobs` processes if
+    the command is parallel-safe.
+
+    The manifest, if given, is only used for incremental commands; see
+    run_serial for details. Profiling always runs serially so that phases
+    aren't skewed by other processes.
+    """
+    if not command_instance.incremental:
+        manifest = None
+    try:
+        if jobs > 1 and command_instance.parallel and not profiler:
+            run_parallel(command_instance, paths, jobs, manifest, force)
+        else:
+            if jobs > 1 and profiler:
+                command_instance.log.warning('Profiling; running serially')
+            elif jobs > 1:
+                command_instance.log.warning(
+                    '%s is not parallel-safe; running serially' %
+                    command_instance.name)
+            run_serial(command_instance, paths, manifest, force, profiler)
+    finally:
+        if manifest:
+            manifest.commit()
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def watch(command_instance, paths, interval=.25):
+    """
+    Run the command again on a simfile whenever any of the files returned by
+    the command's dependencies() for it changes, until interrupted.
+
+    Changes are picked up through inotify if pyinotify is installed and by
+    polling every `interval` seconds otherwise. Everything runs in this
+    process, so any caches the command keeps stay warm between runs, and
+    each simfile is kept in memory unless it is modified by something else.
+    The command is marked as `watching` for the duration, and its done() is
+    called once watching stops.
+    """
+    log = command_instance.log
+    command_instance.watching = True
+    watched = {}
+    for path in paths:
+        dependencies = command_instance.dependencies(path)
+        if dependencies:
+            watched[path] = {
+                'simfile': None,
+                'mtime': _mtime(path),
+                'dependencies': dict((d, _mtime(d)) for d in dependencies),
+            }
+    if not watched:
+        log.warning('%s has nothing to watch' % command_instance.name)
+        command_instance.done()
+        return
+    notifier = None
+    if pyinotify:
+        manager = pyinotify.WatchManager()
+        notifier = pyinotify.Notifier(manager, timeout=interval * 1000)
+        directories = set(os.path.dirname(os.path.abspath(d))
+                          for state in watched.itervalues()
+                          for d in state['dependencies'])
+        manager.add_watch(list(directories), pyinotify.IN_CLOSE_WRITE |
+                          pyinotify.IN_MOVED_TO | pyinotify.IN_CREATE)
+    log.info('Watching %s simfiles for changes; press Ctrl+C to stop' %
+             len(watched))
+    try:
+        while True:
+            if notifier:
+                # Wake up as soon as anything changes, then check everything
+                if notifier.check_events():
+                    notifier.read_events()
+                    notifier.process_events()
+            else:
+                time.sleep(interval)
+            for path, state in sorted(watched.iteritems()):
+                changed = False
+                for dependency, mtime in state['dependencies'].items():
+                    current = _mtime(dependency)
+                    if current != mtime:
+                        state['dependencies'][dependency] = current
+                        changed = True
+                if not changed:
+                    continue
+                start = time.time()
+                # Reparse the simfile only if it changed behind our back
+                if (state['simfile'] is None or
+                        _mtime(path) != state['mtime']):
+                    state['simfile'] = Simfile(path)
+                try:
+                    command_instance.collect(
+                        command_instance.run(state['simfile']))
+                except Exception:
+                    log.error('%s: %s' % (path, traceback.format_exc()
+                                          .splitlines()[-1]))
+                    # Start from the file on disk next time
+                    state['simfile'] = None
+                else:
+                    log.info('Updated %s in %.0f ms' % (
+                        path, (time.time() - start) * 1000))
+                state['mtime'] = _mtime(path)
+    except KeyboardInterrupt:
+        log.info('Stopped watching')
+    finally:
+        if notifier:
+            notifier.stop()
+        command_instance.done()
@@ -1,12 +1,17 @@
 import argparse
+import cProfile
 import itertools
 import logging
 import os
 import sys
+import traceback
 
-from simfile import Simfile
-
-from synctools import __version__, command, settings, utils
+from synctools import __version__, batch, command, settings, utils
+from synctools.index import SimfileIndex
+from synctools.journal import Journal
+from synctools.manifest import RunManifest
+from synctools.pipeline import Pipeline
+from synctools.profiling import Profiler
 
 def main():
     # Set up logging
@@ -17,72 +22,170 @@ def main():
     # Set up argument parsing
     parser = argparse.ArgumentParser()
     parser.add_argument('command', metavar='cmd',
-                        help='the command to run')
+                        help='the command to run, or several commands '
+                             'joined by + to run as a pipeline')
     parser.add_argument('paths', metavar='path', nargs='+',
-                        help='paths to simfiles and/or simfile directories')
+                        help='paths to simfiles and/or simfile directories, '
+                             'or - to read null-separated paths from stdin')
     parser.add_argument('-v', '--version', action='version',
                         version=__version__)
     parser.add_argument('-l', '--ls', action='store_true',
                         help='list installed commands and exit')
     parser.add_argument('-d', '--defaults', action='store_true',
                         help="don't prompt for input; just use default values")
+    parser.add_argument('-j', '--jobs', type=int, default=1, metavar='N',
+                        help='process simfiles in N parallel processes')
+    parser.add_argument('-f', '--force', action='store_true',
+                        help='process every simfile, even those that are '
+                             'unchanged since the last run')
+    parser.add_argument('-p', '--profile', metavar='TRACE',
+                        help='time each simfile and write a JSON-lines trace '
+                             'to TRACE, then summarize (implies --jobs 1)')
+    parser.add_argument('--cprofile', metavar='FILE',
+                        help='write cProfile statistics for the whole batch '
+                             'to FILE')
+    parser.add_argument('-w', '--watch', action='store_true',
+                        help='keep running the command on each simfile '
+                             'whenever its dependencies (e.g. gimmicks.txt) '
+                             'change')
+    parser.add_argument('-i', '--include', action='append', metavar='GLOB',
+                        help='only process simfiles whose path, pack, '
+                             'song folder, title or artist matches GLOB '
+                             '(repeatable)')
+    parser.add_argument('-x', '--exclude', action='append', metavar='GLOB',
+                        help='skip files and folders matching GLOB '
+                             '(repeatable)')
     
     # argparse doesn't know how to handle print-and-exit options outside of
     # --help and --version, so this has to be done before the arguments are
     # parsed.
     if len(sys.argv) >= 2 and sys.argv[1] in ('-l', '--ls'):
-        for command_name, Command in utils.get_commands().items():
+        for command_name, spec in utils.get_command_specs().items():
             print '{name}: {description}'.format(
                 name=command_name,
-                description=Command.description
+                description=spec.description
             )
         sys.exit()
     
+    # Likewise, undo takes a run ID rather than a command and paths
+    if len(sys.argv) >= 2 and sys.argv[1] == 'undo':
+        undo_parser = argparse.ArgumentParser(prog=parser.prog + ' undo')
+        undo_parser.add_argument('run_id', metavar='run-id', nargs='?',
+                                 help='the run to undo; if omitted, list '
+                                      'the runs that can be undone')
+        undo_args = undo_parser.parse_args(sys.argv[2:])
+        journal = Journal()
+        if undo_args.run_id:
+            undo_id = journal.undo(undo_args.run_id)
+            log.info('Run ID: %s' % undo_id)
+        else:
+            for run_id, command_name, count in journal.runs():
+                print '{run_id}: {command} ({count} files)'.format(
+                    run_id=run_id, command=command_name, count=count)
+        sys.exit()
+    
     args = parser.parse_args()
+    if args.jobs < 1:
+        parser.error('--jobs must be at least 1')
     
     # Make sure input files exist
     for path in args.paths:
-        if not os.path.exists(path):
+        if path == '-':
+            # Prompts would consume the path list
+            if not args.defaults:
+                parser.error('reading paths from stdin requires --defaults')
+        elif not os.path.exists(path):
             parser.error('%r: no such file or directory' % path)
     
     # Determine the command to run
-    commands = utils.get_commands()
-    keys = commands.keys()
+    # Several commands joined by "+" run as a pipeline
+    command_names = args.command.split('+')
+    # Only search installed packages for commands that aren't built in
+    specs = utils.get_command_specs(entry_points=False)
+    builtin_ci = set(k.lower() for k in specs)
+    if any(name.lower() not in builtin_ci for name in command_names):
+        specs = utils.get_command_specs()
+    keys = specs.keys()
     # Map lowercase keys to the original CamelCase versions
     keys_ci = dict(zip((k.lower() for k in keys), keys))
-    command_normalized = keys_ci.get(args.command.lower(), None)
-    if not command_normalized:
-        parser.error('invalid command %r' % args.command)
-    Command = commands[command_normalized]
+    pipeline = []
+    for command_name in command_names:
+        command_normalized = keys_ci.get(command_name.lower(), None)
+        if not command_normalized:
+            parser.error('invalid command %r' % command_name)
+        pipeline.append(specs[command_normalized])
     
     # Get options from command line
-    options = {}
-    for field in Command.fields:
-        while True:
-            if args.defaults:
-                # Use the default value
-                value = None
-            else:
-                # Determine default value to show in brackets
-                if field['input'] == command.FieldInputs.boolean:
-                    default_string = 'Y/n' if field['default'] else 'y/N'
+    recipe = []
+    for spec in pipeline:
+        if len(pipeline) > 1 and not args.defaults:
+            print '{name} options:'.format(name=spec.name)
+        options = {}
+        for field in spec.fields:
+            while True:
+                if args.defaults:
+                    # Use the default value
+                    value = None
                 else:
-                    default_string = field['default']
-                # Request user input
-                value = raw_input('{title} [{default}]: '.format(
-                    title=field['title'], default=default_string))
-            if not value:
-                value = field['default']
-            try:
-                options[field['name']] = field['type'](value)
-                break
-            except Exception:
-                print traceback.format_exc().splitlines()[-1]
+                    # Determine default value to show in brackets
+                    if field['input'] == command.FieldInputs.boolean:
+                        default_string = 'Y/n' if field['default'] else 'y/N'
+                    else:
+                        default_string = field['default']
+                    # Request user input
+                    value = raw_input('{title} [{default}]: '.format(
+                        title=field['title'], default=default_string))
+                if not value:
+                    value = field['default']
+                try:
+                    options[field['name']] = field['type'](value)
+                    break
+                except Exception:
+                    print traceback.format_exc().splitlines()[-1]
+        recipe.append((spec.load(), options))
     
-    command_instance = Command(options)
+    if len(recipe) > 1:
+        command_instance = Pipeline(recipe)
+    else:
+        Command, options = recipe[0]
+        command_instance = Command(options)
+    if command_instance.journaling:
+        log.info('Run ID: %s' % command_instance.run_id)
     
-    # Find simfiles
-    simfiles = [utils.find_simfiles(arg) for arg in args.paths]
-    for simfile in itertools.chain(*simfiles):
-        command_instance.run(Simfile(simfile))
-    command_instance.done()
\ No newline at end of file
+    # Find simfiles, streaming them to the command as they are found. The
+    # header index answers title/artist filters without re-reading
+    # unchanged simfiles; in parallel runs, the pool iterates over the
+    # simfiles from another thread.
+    index = SimfileIndex(threaded=True)
+    paths = itertools.chain.from_iterable(
+        utils.read_paths(sys.stdin) if arg == '-' else [arg]
+        for arg in args.paths
+    )
+    simfiles = itertools.chain.from_iterable(
+        utils.iter_simfiles(path, args.include, args.exclude, index)
+        for path in paths
+    )
+    if args.watch:
+        # The simfiles are needed again after the first run, and watch()
+        # calls done() once it's interrupted
+        simfiles = list(simfiles)
+        command_instance.watching = True
+    manifest = RunManifest() if command_instance.incremental else None
+    profiler = Profiler(args.profile) if args.profile else None
+    if args.cprofile:
+        batch_profile = cProfile.Profile()
+        batch_profile.enable()
+    try:
+        batch.run_batch(command_instance, simfiles, args.jobs, manifest,
+                        args.force, profiler)
+    finally:
+        index.commit()
+        if args.cprofile:
+            batch_profile.disable()
+            batch_profile.dump_stats(args.cprofile)
+        if profiler:
+            profiler.close()
+    if profiler:
+        profiler.summary()
+    if args.watch:
+        batch.watch(command_instance, simfiles)
\ No newline at end of file
@@ -1,15 +1,18 @@
 from decimal import *
+import codecs
 import glob
 import itertools
 import logging
 import os
-import shutil
 import sys
 import traceback
 
 from simfile import Simfile
 
-__all__ = ['SynctoolsCommand', 'FieldInputs', 'FieldTypes', 'common_fields']
+from synctools import journal
+
+__all__ = ['SynctoolsCommand', 'CommandSpec', 'FieldInputs', 'FieldTypes',
+           'common_fields']
 
 class SynctoolsCommand(object):
     """
@@ -31,19 +34,46 @@ class SynctoolsCommand(object):
 
     Fields are parsed in __init__ and exposed through a dict at self.options. A
     handful of common fields are defined in synctools.command.common_fields:
-    "backup", which backs up the input .sm files, and "global_offset", which
-    gets the user's global offset and stores it as a Decimal object.
+    "backup", which journals the header tags changed in the input .sm files so
+    that runs can be undone, and "global_offset", which gets the user's global
+    offset and stores it as a Decimal object.
 
     Logging should be done through the Logger object at self.log.
+
+    Commands whose output depends only on the simfile, their options and the
+    files returned by dependencies() should set `incremental` to True. When
+    run through synctools-cli, such commands skip simfiles that haven't
+    changed since the last run with the same options. Commands should call
+    self.save() rather than simfile.save(), so that unchanged simfiles aren't
+    rewritten.
+
+    Commands that can safely process several simfiles at once in separate
+    processes should set `parallel` to True. Each worker process creates its
+    own instance of the command, so any state meant for done() should be
+    returned from run() and accumulated in collect(), which is always called
+    on the instance that receives done().
     """
     
     title = ''
     description = ''
     fields = []
+    parallel = False
+    incremental = False
+    # Set by Pipeline: save() only notes that the simfile was modified, and
+    # the pipeline backs up and saves the simfile once for all its commands
+    deferred = False
+    # Set by synctools.batch.watch: run() will be called again on the same
+    # simfiles as their dependencies change, so it's worth keeping state
+    # between runs; done() is called once watching stops
+    watching = False
     
     def __init__(self, options):
         self.log = logging.getLogger('synctools')
-        self.log.info('Initializing %s...' % self.__class__.__name__)
+        self.log.info('Initializing %s...' % self.name)
+        # Changes made by this instance are journaled under this ID
+        self.run_id = journal.new_run_id()
+        self.journal = journal.Journal()
+        self.backup_tags = None
         # Verify option types
         self.options = {}
         for key, value in options.items():
@@ -58,12 +88,87 @@ class SynctoolsCommand(object):
                                 (value, key))
             self.options[key] = parsed_value
     
+    @property
+    def name(self):
+        """
+        The command's name, as used on the command line.
+        """
+        return self.__class__.__name__
+    
+    @property
+    def journaling(self):
+        """
+        Whether the command journals its changes, so that its run can be
+        undone by run ID.
+        """
+        return bool(self.options.get('backup') or
+                    self.options.get('backup_audio'))
+    
+    def init_args(self):
+        """
+        Return the arguments needed to create an identical instance of the
+        command, e.g. in a worker process.
+        """
+        return (self.options,)
+    
     def backup(self, simfile):
         """
-        Backup the current simfile. If `backup` is set to True in the command's
-        options, this is automatically called before each run().
+        Remember the current simfile's header tags. If `backup` is set to True
+        in the command's options, this is automatically called before each
+        run(), and save() journals the previous value of every tag that the
+        run changed, so that it can be undone with ``synctools-cli undo``.
+        """
+        with codecs.open(simfile.filename, 'r', encoding='utf-8') as sm:
+            self.backup_tags = (simfile.filename,
+                                journal.header_tags(sm.read()))
+    
+    def dependencies(self, filename):
+        """
+        Return a list of paths to files, besides the simfile itself, whose
+        contents affect the result of running the command on the simfile.
+        """
+        return []
+    
+    def save(self, simfile):
+        """
+        Write the simfile to disk, unless its serialized form is identical to
+        what's already there. Returns True if the simfile was written.
+        """
+        if self.deferred:
+            self.modified = True
+            return True
+        output = unicode(simfile)
+        try:
+            with codecs.open(simfile.filename, 'r', encoding='utf-8') as sm:
+                if sm.read() == output:
+                    self.log.debug('Simfile is unchanged; not saving')
+                    return False
+        except (IOError, UnicodeDecodeError):
+            pass
+        if self.options.get('backup'):
+            self.journal_changes(simfile.filename, output)
+        simfile.save()
+        return True
+    
+    def journal_changes(self, filename, output):
+        """
+        Journal the previous values of the header tags that differ between
+        the tags remembered by backup() and the new serialized simfile.
         """
-        shutil.copy2(simfile.filename, simfile.filename + '~')
+        if not self.backup_tags or self.backup_tags[0] != filename:
+            return
+        old_tags = self.backup_tags[1]
+        new_tags = journal.header_tags(output)
+        changed = {}
+        for tag in set(old_tags) | set(new_tags):
+            old_value, new_value = old_tags.get(tag), new_tags.get(tag)
+            if old_value is None or new_value is None:
+                if old_value != new_value:
+                    changed[tag] = old_value
+            elif old_value.strip() != new_value.strip():
+                changed[tag] = old_value
+        if changed:
+            self.journal.record(self.run_id, self.name, filename, changed)
     
     def run(self, simfile):
         """
@@ -71,9 +176,16 @@ class SynctoolsCommand(object):
         <http://grantgarcia.org/simfile/>`_ for details on the simfile object.
         """
         self.log.info('Processing %s...' % simfile.get('TITLE', '<untitled>'))
-        if self.options.get('backup'):
+        if self.options.get('backup') and not self.deferred:
             self.backup(simfile)
     
+    def collect(self, result):
+        """
+        Receive the value returned by run() for a single simfile. Unlike
+        run(), this is never called from a worker process.
+        """
+        pass
+    
     def done(self):
         """
         Clean up after all simfiles have been processed.
@@ -81,6 +193,54 @@ class SynctoolsCommand(object):
         self.log.info('Done.')
 
 
+class CommandSpec(object):
+    """
+    Describes a command without importing the module that implements it.
+
+    `module` is the dotted name of the module containing the command class,
+    and `attribute` is the name of the class within it, which defaults to the
+    name of the command. Any of `title`, `description` and `fields` that are
+    omitted are read from the class itself, which means importing it.
+    """
+    
+    def __init__(self, name, module, title=None, description=None,
+                 fields=None, attribute=None):
+        self.name = name
+        self.module = module
+        self.attribute = attribute or name
+        self._title = title
+        self._description = description
+        self._fields = fields
+        self._command = None
+    
+    def load(self):
+        """
+        Import the command's module and return the command class.
+        """
+        if not self._command:
+            module = __import__(self.module, fromlist=[self.attribute])
+            self._command = getattr(module, self.attribute)
+        return self._command
+    
+    @property
+    def title(self):
+        if self._title is None:
+            return self.load().title
+        return self._title
+    
+    @property
+    def description(self):
+        if self._description is None:
+            return self.load().description
+        return self._description
+    
+    @property
+    def fields(self):
+        if self._fields is None:
+            return self.load().fields
+        return self._fields
+
+
 class FieldInputs(object):
     """
     Exposes two attributes, `text` and `boolean`, that determine the input
@@ -126,6 +286,18 @@ class FieldTypes(object):
             return value
         return _between
 
+    @staticmethod
+    def choice(*choices):
+        """
+        Returns a function that coerces its input value to a string and
+        asserts that it is one of `choices`.
+        """
+        def _choice(value):
+            value = str(value)
+            assert value in choices, "value in %s" % (choices,)
+            return value
+        return _choice
+
 
 common_fields = {
     'backup': {
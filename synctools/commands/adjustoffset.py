@@ -2,23 +2,16 @@
 from decimal import *
 
 from synctools import command
+from synctools.commands.manifest import manifest
 
 __all__ = ['AdjustOffset']
 
 class AdjustOffset(command.SynctoolsCommand):
     
-    title = 'Adjust offset'
-    description = 'tweak offsets for hardware delay and/or personal preference'
-    fields = [
-        {
-            'name': 'amount',
-            'title': 'Seconds to add',
-            'input': command.FieldInputs.text,
-            'default': '0.000',
-            'type': Decimal,
-        },
-        command.common_fields['backup'],
-    ]
+    title = manifest['adjustoffset'].title
+    description = manifest['adjustoffset'].description
+    fields = manifest['adjustoffset'].fields
+    parallel = True
     
     def run(self, simfile):
         super(AdjustOffset, self).run(simfile)
@@ -26,4 +19,4 @@ class AdjustOffset(command.SynctoolsCommand):
         new_offset = Decimal(old_offset) + self.options['amount']
         self.log.info('%s -> %s' % (old_offset, new_offset))
         simfile['OFFSET'] = new_offset
-        simfile.save()
\ No newline at end of file
+        self.save(simfile)
\ No newline at end of file
@@ -1,180 +1,229 @@
 #!/usr/bin/env python
+from array import array
 from decimal import Decimal
-import math
+import itertools
 import os
-import random
-import wave
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
-from synctools import command
+from synctools import command, sounds
+from synctools.commands.manifest import manifest
+from synctools.notes import HEADS, MINE, note_index
+from synctools.timing import TimingEngine
+from synctools.wav import WavWriter
 
 __all__ = ['ClickTrack']
 
+# Preference order for the default chart
+DIFFICULTIES = ('Challenge', 'Hard', 'Medium', 'Easy', 'Beginner', 'Edit')
+STEPSTYPES = tuple(game + '-' + sd for game in ('dance', 'pump', 'ez2')
+                   for sd in ('single', 'double'))
+
 class ClickTrack(command.SynctoolsCommand):
     
-    title = 'Click track'
-    description = 'generate a click track WAV file'
-    fields = [
-        {
-            'name': 'metronome',
-            'title': 'Metronome (noise on each beat)',
-            'input': command.FieldInputs.boolean,
-            'default': True,
-            'type': command.FieldTypes.yesno,
-        },
-        {
-            'name': 'taps',
-            'title': 'Taps (sine bloop on each tap note)',
-            'input': command.FieldInputs.boolean,
-            'default': True,
-            'type': command.FieldTypes.yesno,
-        },
-        {
-            'name': 'mines',
-            'title': 'Mines (square bloop on each mine)',
-            'input': command.FieldInputs.boolean,
-            'default': True,
-            'type': command.FieldTypes.yesno,
-        },
-        {
-            'name': 'amplitude',
-            'title': 'Amplitude',
-            'input': command.FieldInputs.text,
-            'default': 0.8,
-            'type': command.FieldTypes.between(0, 1, float),
-        },
-        command.common_fields['global_offset'],
-    ]
-    
-    sample_rate = 44100
+    title = manifest['clicktrack'].title
+    description = manifest['clicktrack'].description
+    fields = manifest['clicktrack'].fields
+    parallel = True
     
     def __init__(self, options):
         super(ClickTrack, self).__init__(options)
-        # Generate sounds for the clicktrack
-        amp = self.options['amplitude']
-        self.sound = {
-            'metronome': ''.join([
-                chr(int(random.randrange(256) * a + 127 * (1 - a)))
-                for a in [amp * b / 1024. for b in xrange(1024, 0, -1)]
-            ]),
-            'tap': ''.join([
-                chr(int((math.sin(b / 4.) * 127 + 127) * a + 127 * (1 - a)))
-                for a, b in [(amp * b / 1024., b) for b in xrange(1024, 0, -1)]
-            ]),
-            'mine': ''.join([
-                chr(int((int(b / 128) % 2) * 255 * a + 127 * (1 - a)))
-                for a, b in [(amp * b / 1024., b) for b in xrange(1024, 0, -1)]
-            ]),
-        }
+        self.sample_rate = self.options['sample_rate']
+        # Sounds are samples between -1 and 1, shared between instances
+        self.sound = {}
+        for name in sounds.generators:
+            filename = None
+            if self.options['sounds']:
+                filename = os.path.join(self.options['sounds'], name + '.wav')
+                if not os.path.isfile(filename):
+                    filename = None
+            self.sound[name] = sounds.bank.get(
+                name, self.options['amplitude'], self.sample_rate, filename)
+    
+    def index_charts(self, simfile):
+        """
+        Index the simfile's charts by lowercase stepstype and difficulty.
+        """
+        self.charts = {}
+        for chart in simfile.charts:
+            self.charts.setdefault(chart.stepstype.lower(), []).append(chart)
+            self.charts.setdefault(chart.difficulty.lower(), []).append(chart)
     
     def get_hardest_chart(self):
-        for diff in ('Challenge', 'Hard', 'Medium', 'Easy', 'Beginner', 'Edit'):
-            for game in ('dance', 'pump', 'ez2'):
-                for sd in ('single', 'double'):
-                    try:
-                        chart = self.simfile.charts.get(
-                            difficulty=diff, stepstype=(game + '-' + sd)
-                        )
-                        return chart
-                    except LookupError:
-                        pass
+        charts = [chart for chart in self.simfile.charts
+                  if chart.difficulty in DIFFICULTIES and
+                  chart.stepstype in STEPSTYPES]
+        if charts:
+            return min(charts, key=lambda chart: (
+                DIFFICULTIES.index(chart.difficulty),
+                STEPSTYPES.index(chart.stepstype)))
     
-    def current_bpm(self, beat):
-        # Get all the BPMs that are before the current beat,
-        # then return the last one
-        return [value for t, value in self.simfile['BPMS'] if t <= beat][-1]
+    def select_charts(self):
+        """
+        Return the charts chosen by the "charts" option.
+        """
+        selection = self.options['charts']
+        if selection.lower() == 'all':
+            return list(self.simfile.charts)
+        if selection:
+            terms = selection.lower().split()
+            charts = self.charts.get(terms[0], [])
+            if len(terms) > 1:
+                charts = [chart for chart in charts if terms[1] in (
+                    chart.stepstype.lower(), chart.difficulty.lower())]
+            return charts
+        chart = self.get_hardest_chart()
+        if not chart:
+            self.log.warning('Unable to find any dance, pump, or ez2 charts')
+            # Get whatever the first chart is
+            if self.simfile.charts:
+                chart = self.simfile.charts[0]
+        return [chart] if chart else []
+    
+    def output_filename(self, chart, used):
+        """
+        Return the WAV filename for a chart: clicktrack.wav for the default
+        selection, otherwise one named after the chart.
+        """
+        if not self.options['charts']:
+            return 'clicktrack.wav'
+        name = 'clicktrack-%s-%s' % (chart.stepstype, chart.difficulty)
+        # Several charts may share a stepstype and difficulty (e.g. edits)
+        used[name] = used.get(name, 0) + 1
+        if used[name] > 1:
+            name += '-%s' % used[name]
+        return name + '.wav'
     
     def seconds_between_beats(self, start, end):
-        bpm = self.current_bpm(start)
-        pos = start
-        seconds = 0.
-        # Iterate over the timing events
-        for event, t, value in self.timing_events:
-            if start <= t < end:
-                # Add the time elapsed between the previous and current beats,
-                # which are guaranteed to have no timing events between them
-                seconds += float(60 / bpm) * (t - pos)
-                # Handle timing event
-                if event == 'stop':
-                    seconds += float(value)
-                elif event == 'bpm':
-                    bpm = value
-                # Update position
-                pos = t
-            elif t >= end:
-                # At this point there's no need to loop any further
-                break
-        # The last observed position will be less than the ending beat;
-        # add the remaining time now
-        seconds += float(60 / bpm) * (end - pos)
-        return seconds
+        return self.timing.seconds_between(start, end)
+    
+    def render(self, clicks, seconds, length, shift=0, block_size=65536):
+        """
+        Mix the sounds for `clicks` (a list of (beat, sound name) pairs),
+        starting at the corresponding `seconds` less `shift` samples, and
+        yield the first `length` samples in blocks of `block_size`.
+        Overlapping sounds are added together; clipping happens on output.
+        Only the clicks that overlap the current block are mixed, so memory
+        use doesn't depend on the length of the song.
+        """
+        if numpy:
+            for block in self.render_numpy(clicks, seconds, length, shift,
+                                           block_size):
+                yield block
+            return
+        events = sorted((int(second * self.sample_rate) - shift, name)
+                        for second, (beat, name) in zip(seconds, clicks))
+        width = max(len(sound) for sound in self.sound.values())
+        first = 0
+        for block_start in xrange(0, length, block_size):
+            block_end = min(block_start + block_size, length)
+            block = array('d', [0.]) * (block_end - block_start)
+            # Skip clicks that finished before this block
+            while (first < len(events) and
+                   events[first][0] + width <= block_start):
+                first += 1
+            for start, name in itertools.islice(events, first, None):
+                if start >= block_end:
+                    break
+                sound = self.sound[name]
+                for i in xrange(max(start, block_start),
+                                min(start + len(sound), block_end)):
+                    block[i - block_start] += sound[i - start]
+            yield block
+    
+    def render_numpy(self, clicks, seconds, length, shift, block_size):
+        # One row per sound, padded to the longest one
+        names = sorted(self.sound)
+        width = max(len(sound) for sound in self.sound.values())
+        sounds = numpy.zeros((len(names), width))
+        for row, name in enumerate(names):
+            sounds[row, :len(self.sound[name])] = self.sound[name]
+        starts = (numpy.asarray(seconds) * self.sample_rate).astype(numpy.int64)
+        starts -= shift
+        kinds = numpy.array([names.index(name) for beat, name in clicks])
+        order = numpy.argsort(starts, kind='mergesort')
+        starts, kinds = starts[order], kinds[order]
+        window = numpy.arange(width)
+        for block_start in xrange(0, length, block_size):
+            block_end = min(block_start + block_size, length)
+            # Clicks that overlap this block
+            lo = numpy.searchsorted(starts, block_start - width, 'right')
+            hi = numpy.searchsorted(starts, block_end, 'left')
+            indices = starts[lo:hi, None] - block_start + window
+            weights = sounds[kinds[lo:hi]]
+            inside = (indices >= 0) & (indices < block_end - block_start)
+            # bincount sums the samples of overlapping sounds, which fancy
+            # indexing wouldn't
+            yield numpy.bincount(indices[inside], weights[inside],
+                                 block_end - block_start)
     
     def run(self, simfile):
         super(ClickTrack, self).run(simfile)
         self.simfile = simfile
         
-        # Convert BPMS and STOPS to "timing events" - a combination of the two
-        # event types in one list
-        self.timing_events = [('bpm', t, v) for t, v in simfile['BPMS']]
-        self.timing_events += [('stop', t, v) for t, v in simfile['STOPS']]
-        self.timing_events.sort(key=lambda item: item[1])
+        # Precompute the time of every BPM change and stop
+        self.timing = TimingEngine.from_simfile(simfile, offset=False)
         
         # Combine simfile's offset with the given global offset
         offset = Decimal(simfile['OFFSET']) + self.options['global_offset']
         
-        # Retrieve the hardest chart, if possible
-        chart = self.get_hardest_chart()
-        if not chart:
-            self.log.warning('Unable to find any dance, pump, or ez2 charts')
-            # Get whatever the first chart is
-            try:
-                chart = simfile.charts[0]
-            except IndexError:
+        # Pick the charts to render
+        self.index_charts(simfile)
+        charts = self.select_charts()
+        if not charts:
+            if simfile.charts:
+                self.log.error('No charts match %r; aborting' %
+                               self.options['charts'])
+            else:
                 self.log.error('This simfile has no charts; aborting')
-                return
+            return
+        
+        # Shift the clicks to compensate for offset
+        offset_samples = int(offset * self.sample_rate)
+        used = {}
+        for chart in charts:
+            self.render_chart(chart, os.path.join(
+                os.path.dirname(simfile.filename),
+                self.output_filename(chart, used)), offset_samples)
+    
+    def render_chart(self, chart, filename, offset_samples):
+        """
+        Write the click track for a single chart to `filename`.
+        """
         self.log.info('Using {stepstype} {difficulty} chart'.format(
             stepstype=chart.stepstype,
             difficulty=chart.difficulty,
         ))
         
         # Determine where to place clicks
+        notes = note_index(self.simfile, chart)
         clicks = []
         if self.options['metronome']:
-            for i in xrange(int(chart.notes[-1][0])):
+            for i in xrange(int(notes.last_beat)):
                 clicks.append((i, 'metronome'))
-        for t, line in chart.notes:
-            if any([c in '124' for c in line]) and self.options['taps']:
-                clicks.append((t, 'tap'))
-            if any([c == 'M' for c in line]) and self.options['mines']:
-                clicks.append((t, 'mine'))
+        if self.options['taps']:
+            clicks.extend((t, 'tap') for t in notes.beats_with(HEADS))
+        if self.options['mines']:
+            clicks.extend((t, 'mine') for t in notes.beats_with(MINE))
         clicks.sort(key=lambda item: item[0])
         self.log.debug('%s clicks loaded' % len(clicks))
+        if not clicks:
+            self.log.warning('No clicks to render; skipping chart')
+            return
+
+        # Convert every click's beat to seconds in one pass
+        seconds = self.timing.seconds_at_beats(beat for beat, sound in clicks)
         
         # Length of audio file = distance from beat 0 to last beat + padding
-        audio_length = self.seconds_between_beats(0, clicks[-1][0]) + 1
+        audio_length = seconds[-1] + 1
+        length = int(self.sample_rate * audio_length) - offset_samples
         
-        # Write click track to memory buffer
+        # Mix the clicks and write them to WAV one block at a time
         self.log.info('Generating click track')
-        buffer = bytearray('\x80' * int(self.sample_rate * audio_length))
-        last_beat = second = 0
-        for beat, sound in clicks:
-            second += self.seconds_between_beats(last_beat, beat)
-            sample = int(second * self.sample_rate)
-            buffer[sample:sample+1024] = self.sound[sound]
-            last_beat = beat
-        
-        # Compensate for offset
-        offset_samples = int(offset * self.sample_rate)
-        if offset_samples > 0:
-            del buffer[:offset_samples]
-        elif offset_samples < 0:
-            buffer[0:0] = '\x80' * abs(offset_samples)
-        
-        # Write to WAV
-        self.log.info('Writing WAV file')
-        wav = os.path.join(os.path.dirname(simfile.filename), 'clicktrack.wav')
-        clicks_h = wave.open(wav, 'w')
-        clicks_h.setnchannels(1)
-        clicks_h.setsampwidth(1)
-        clicks_h.setframerate(self.sample_rate)
-        clicks_h.writeframes(str(buffer))
-        clicks_h.close()
\ No newline at end of file
+        clicks_h = WavWriter(filename, self.sample_rate,
+                             self.options['sample_format'])
+        for block in self.render(clicks, seconds, length, offset_samples):
+            clicks_h.writesamples(block)
+        clicks_h.close()
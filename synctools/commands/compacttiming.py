@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+from simfile import Timing
+
+from synctools import command
+from synctools.commands.manifest import manifest
+from synctools.notes import note_index
+from synctools.timing import TimingEngine, compact
+
+__all__ = ['CompactTiming']
+
+class CompactTiming(command.SynctoolsCommand):
+    
+    title = manifest['compacttiming'].title
+    description = manifest['compacttiming'].description
+    fields = manifest['compacttiming'].fields
+    parallel = True
+    incremental = True
+    
+    def __init__(self, options):
+        super(CompactTiming, self).__init__(options)
+        self.removed = 0
+        self.total = 0
+    
+    def note_beats(self, simfile):
+        """
+        Return the beat of every row with a note in any chart.
+        """
+        beats = set()
+        for chart in simfile.charts:
+            beats.update(float(beat) for beat in
+                         note_index(simfile, chart).beats)
+        return sorted(beats)
+    
+    def run(self, simfile):
+        super(CompactTiming, self).run(simfile)
+        bpms = list(simfile['BPMS'])
+        stops = list(simfile.get('STOPS') or ())
+        before = len(bpms) + len(stops)
+        tolerance = self.options['tolerance'] / 1000.
+        note_beats = self.note_beats(simfile)
+        try:
+            new_bpms, new_stops = compact(
+                bpms, stops, tolerance,
+                note_beats if self.options['notes_only'] else None)
+        except ValueError, e:
+            self.log.warn('Not compacting: %s' % e)
+            return
+        after = len(new_bpms) + len(new_stops)
+        if after >= before:
+            self.log.info('Timing is already compact (%s events)' % before)
+            return (before, 0)
+        
+        # Make sure every note (and, unless only notes are being kept in
+        # time, every original event) is still hit on time
+        old = TimingEngine(bpms, stops)
+        new = TimingEngine(new_bpms, new_stops)
+        check = note_beats
+        if not self.options['notes_only']:
+            check = sorted(set(check) | set(old.beats))
+        error = max([abs(a - b) for a, b in zip(old.seconds_at_beats(check),
+                                                new.seconds_at_beats(check))]
+                    or [0.])
+        if error > tolerance + 1e-9:
+            self.log.error('Compacted timing is off by %.3f ms; not saving' %
+                           (error * 1000))
+            return
+        
+        simfile['BPMS'] = Timing(','.join('%s=%s' % pair
+                                          for pair in new_bpms))
+        simfile['STOPS'] = Timing(','.join('%s=%s' % pair
+                                           for pair in new_stops))
+        self.save(simfile)
+        self.log.info('Removed %s of %s timing events (off by at most '
+                      '%.3f ms)' % (before - after, before, error * 1000))
+        return (before, before - after)
+    
+    def collect(self, result):
+        if result:
+            self.total += result[0]
+            self.removed += result[1]
+    
+    def done(self):
+        self.log.info('Removed %s of %s timing events in total' % (
+            self.removed, self.total))
+        super(CompactTiming, self).done()
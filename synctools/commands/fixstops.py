@@ -1,67 +1,228 @@
 #!/usr/bin/env python
+import csv
+import json
+try:
+    import numpy
+except ImportError:
+    numpy = None
 from simfile import Timing
 
 from synctools import command
+from synctools.commands.manifest import manifest
+from synctools.timing import TICKS_PER_BEAT, to_ticks
 
 __all__ = ['FixStops']
 
 class FixStops(command.SynctoolsCommand):
     
-    title = 'Fix stops'
-    description = 'mitigate the effects of imprecise rounding in stop values'
-    fields = [command.common_fields['backup']]
+    title = manifest['fixstops'].title
+    description = manifest['fixstops'].description
+    fields = manifest['fixstops'].fields
+    parallel = True
+    incremental = True
     margin = 0.001
     
+    def __init__(self, options):
+        super(FixStops, self).__init__(options)
+        if self.options['analyze']:
+            # Nothing gets written, and every simfile has to be reported on
+            self.options['backup'] = False
+            self.incremental = False
+        self.report = []
+    
+    def snap_stops(self, bpms, stops):
+        """
+        Find the whole number of 192nd notes (at the BPM in effect) nearest
+        to each stop's length. Returns a list of (beat, length, snapped
+        length) tuples sorted by beat, where the snapped length is None if
+        it isn't within `margin` of the stop's length or the BPM in effect
+        isn't positive.
+        
+        Like TimingStore, this counts 192nd notes as integers and converts
+        back to seconds with a single division, so no rounding error builds
+        up for long stops.
+        """
+        bpms = sorted((float(b), float(v)) for b, v in bpms)
+        stops = sorted((float(b), float(v)) for b, v in stops)
+        if numpy and stops:
+            return self.snap_stops_numpy(bpms, stops)
+        snapped = []
+        # Sweep through the BPMs alongside the stops
+        i = 0
+        for stop_start, stop_value in stops:
+            while i + 1 < len(bpms) and bpms[i + 1][0] <= stop_start:
+                i += 1
+            bpm_value = bpms[i][1]
+            if bpm_value <= 0:
+                self.log.warn('Not snapping stop at %s to BPM %s' % (
+                    stop_start, bpm_value))
+                snapped.append((stop_start, stop_value, None))
+                continue
+            # Really big BPM values should be decreased until they're
+            # reasonable
+            while bpm_value > 625:
+                bpm_value /= 2
+            ticks = max(to_ticks(stop_value * bpm_value / 60), 1)
+            stop_real = ticks * 60 / (bpm_value * TICKS_PER_BEAT)
+            if abs(stop_real - stop_value) > self.margin:
+                stop_real = None
+            snapped.append((stop_start, stop_value, stop_real))
+        return snapped
+    
+    def snap_stops_numpy(self, bpms, stops):
+        bpm_starts, bpm_values = numpy.array(bpms).T
+        stop_starts, stop_values = numpy.array(stops).T
+        # BPM in effect at each stop (the first BPM for any stops before it)
+        i = numpy.maximum(
+            numpy.searchsorted(bpm_starts, stop_starts, 'right') - 1, 0)
+        bpm_values = bpm_values[i]
+        positive = bpm_values > 0
+        for start, bpm_value in zip(stop_starts[~positive].tolist(),
+                                    bpm_values[~positive].tolist()):
+            self.log.warn('Not snapping stop at %s to BPM %s' % (
+                start, bpm_value))
+        # Any positive value keeps the arithmetic below finite; these stops
+        # are marked invalid anyway
+        bpm_values = numpy.where(positive, bpm_values, 1.)
+        while (bpm_values > 625).any():
+            bpm_values = numpy.where(bpm_values > 625, bpm_values / 2,
+                                     bpm_values)
+        ticks = numpy.maximum(numpy.round(
+            stop_values * bpm_values / 60 * TICKS_PER_BEAT), 1)
+        stop_real = ticks * 60 / (bpm_values * TICKS_PER_BEAT)
+        valid = positive & (numpy.abs(stop_real - stop_values) <= self.margin)
+        return [(start, value, real if ok else None)
+                for start, value, real, ok in zip(stop_starts.tolist(),
+                                                  stop_values.tolist(),
+                                                  stop_real.tolist(),
+                                                  valid.tolist())]
+    
+    def correct_stops(self, snapped):
+        """
+        Nudge stop lengths by a millisecond wherever the rounding error
+        accumulated so far exceeds half a millisecond. Takes the output of
+        :meth:`snap_stops` and yields (beat, length, snapped length,
+        corrected length, residue) tuples, where the residue is the number
+        of seconds by which the chart is early after that stop.
+        """
+        residue = 0.0
+        for stop_start, stop_value, stop_real in snapped:
+            original_value = stop_value
+            if stop_real is None:
+                self.log.warn('Could not correct stop at %s' % stop_start)
+            else:
+                self.log.debug('Real value of stop at %s is %s' % (stop_start, stop_real))
+                residue += stop_value - stop_real
+                self.log.debug('Current residue is %s' % residue)
+                # Chart is more than half a ms early
+                if residue > .0005:
+                    self.log.debug('Chart is now early; decreasing stop value')
+                    residue -= .001
+                    stop_value -= .001
+                # Chart is at least half a ms late
+                elif residue <= -.0005:
+                    self.log.debug('Chart is now late; increasing stop value')
+                    residue += .001
+                    stop_value += .001
+            yield stop_start, original_value, stop_real, stop_value, residue
+    
+    def analyze(self, simfile, snapped):
+        """
+        Summarize the rounding error of each stop without changing anything.
+        """
+        stops = []
+        drift = 0.0
+        max_drift = 0.0
+        corrections = 0
+        for stop_start, stop_value, stop_real, corrected, residue in \
+                self.correct_stops(snapped):
+            corrections += int(round((corrected - stop_value) * 1000))
+            stop = {'beat': stop_start, 'length': stop_value,
+                    'snapped': stop_real, 'error_ms': None,
+                    'drift_ms': None}
+            if stop_real is not None:
+                drift += stop_value - stop_real
+                max_drift = max(max_drift, abs(drift))
+                stop['error_ms'] = (stop_value - stop_real) * 1000
+                stop['drift_ms'] = drift * 1000
+            stops.append(stop)
+        uncorrectable = [stop['beat'] for stop in stops
+                         if stop['snapped'] is None]
+        errors = [abs(stop['error_ms']) for stop in stops
+                  if stop['error_ms'] is not None]
+        self.log.info('%.1f ms of drift, %s uncorrectable stops' % (
+            drift * 1000, len(uncorrectable)))
+        return {
+            'path': simfile.filename,
+            'title': simfile.get('TITLE', ''),
+            'stops': len(stops),
+            'uncorrectable': len(uncorrectable),
+            'uncorrectable_beats': uncorrectable,
+            'max_error_ms': max(errors) if errors else 0.,
+            'drift_ms': drift * 1000,
+            'max_drift_ms': max_drift * 1000,
+            'correction_ms': abs(corrections),
+            'details': stops,
+        }
+    
     def run(self, simfile):
         super(FixStops, self).run(simfile)
-        # Retrieve the needed data
-        bpms = simfile['BPMS']
-        stops = simfile['STOPS']
+        snapped = self.snap_stops(simfile['BPMS'], simfile['STOPS'])
+        if self.options['analyze']:
+            return self.analyze(simfile, snapped)
         # Fix stop values
-        # 'residue' contains the number of seconds by which the chart is early
         drift = 0
-        residue = 0.0
         new_stops = []
-        while stops:
-            stop_start, stop_value = (float(s) for s in stops.pop(0))
-            # Get current BPM
-            bpm_start = 0.0
-            for bpm_s, bpm_v in bpms:
-                if bpm_s > bpm_start and bpm_s <= stop_start:
-                    bpm_start, bpm_value = float(bpm_s), float(bpm_v)
-            # Really big BPM values should be decreased until they're reasonable
-            while bpm_value > 625:
-                bpm_value /= 2
-            # Determine real stop value
-            stop_real = stop_192nd = 60 / bpm_value / 48
-            corrected_stop = False
-            while stop_real <= stop_value + self.margin:
-                # Found a good approximation yet?
-                if stop_real >= stop_value - self.margin:
-                    self.log.debug('Real value of stop at %s is %s' % (stop_start, stop_real))
-                    residue += stop_value - stop_real
-                    self.log.debug('Current residue is %s' % residue)
-                    # Chart is more than half a ms early
-                    if residue > .0005:
-                        self.log.debug('Chart is now early; decreasing stop value')
-                        residue -= .001
-                        stop_value -= .001
-                        drift -= 1
-                    # Chart is at least half a ms late
-                    elif residue <= -.0005:
-                        self.log.debug('Chart is now late; increasing stop value')
-                        residue += .001
-                        stop_value += .001
-                        drift += 1
-                    corrected_stop = True
-                    break
-                stop_real += stop_192nd
-            if not corrected_stop:
-                self.log.warn('Could not correct stop at %s' % stop_start)
-            new_stops.append((round(stop_start, 3), stop_value))
+        for stop_start, stop_value, stop_real, corrected, residue in \
+                self.correct_stops(snapped):
+            drift += int(round((corrected - stop_value) * 1000))
+            new_stops.append((round(stop_start, 3), corrected))
         # Reassemble stops data
         simfile['STOPS'] = Timing(','.join(
             ['%s=%s' % new_stop for new_stop in new_stops]
         ))
-        simfile.save()
-        self.log.info('Corrected about %s milliseconds of drift' % abs(drift))
\ No newline at end of file
+        self.save(simfile)
+        self.log.info('Corrected about %s milliseconds of drift' % abs(drift))
+    
+    def collect(self, result):
+        if result:
+            self.report.append(result)
+    
+    def done(self):
+        if self.options['analyze']:
+            self.write_report()
+        super(FixStops, self).done()
+    
+    def write_report(self):
+        """
+        Write the collected analyses to the report file, worst drift first.
+        CSV reports have one row per simfile; JSON reports also include
+        every stop.
+        """
+        self.report.sort(key=lambda row: abs(row['drift_ms']), reverse=True)
+        filename = self.options['report']
+        with open(filename, 'wb') as report:
+            if filename.lower().endswith('.json'):
+                json.dump(self.report, report, indent=4, sort_keys=True)
+            else:
+                writer = csv.writer(report)
+                writer.writerow(self.report_columns)
+                for row in self.report:
+                    writer.writerow([self.format_cell(row[column])
+                                     for column in self.report_columns])
+        self.log.info('Wrote report on %s simfiles to %s' % (
+            len(self.report), filename))
+    
+    report_columns = ('path', 'title', 'stops', 'uncorrectable',
+                      'max_error_ms', 'drift_ms', 'max_drift_ms',
+                      'correction_ms', 'uncorrectable_beats')
+    
+    @staticmethod
+    def format_cell(value):
+        if isinstance(value, float):
+            return '%.3f' % value
+        elif isinstance(value, list):
+            return ' '.join('%.3f' % beat for beat in value)
+        elif isinstance(value, unicode):
+            return value.encode('utf-8')
+        return value
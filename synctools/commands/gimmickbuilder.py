@@ -1,74 +1,31 @@
 #!/usr/bin/env python
-from fractions import Fraction
+import csv
 import os
 try:
-    from collections import OrderedDict
+    import numpy
 except ImportError:
-    from ordereddict import OrderedDict
-
-from simfile import decimal_from_192nd, Timing
-import yaml
-import yaml.constructor
-try:
-    from yaml import CLoader as Loader, CDumper as Dumper
-except ImportError:
-    from yaml import Loader, Dumper
+    numpy = None
 
 from synctools import command
+from synctools.commands.manifest import manifest
+from synctools.commands.gimmickbuilder_versions.ordered_yaml import \
+    load as load_yaml
+from synctools.commands.gimmickbuilder_versions.timing_store import \
+    TimingStore
+from synctools.notes import note_index
+from synctools.timing import TimingEngine
 
 __all__ = ['GimmickBuilder']
 
-class OrderedDictYAMLLoader(yaml.Loader):
-    """
-    A YAML loader that loads mappings into ordered dictionaries.
-    """
-
-    def __init__(self, *args, **kwargs):
-        yaml.Loader.__init__(self, *args, **kwargs)
-
-        self.add_constructor(u'tag:yaml.org,2002:map', type(self).construct_yaml_map)
-        self.add_constructor(u'tag:yaml.org,2002:omap', type(self).construct_yaml_map)
-
-    def construct_yaml_map(self, node):
-        data = OrderedDict()
-        yield data
-        value = self.construct_mapping(node)
-        data.update(value)
-
-    def construct_mapping(self, node, deep=False):
-        if isinstance(node, yaml.MappingNode):
-            self.flatten_mapping(node)
-        else:
-            raise yaml.constructor.ConstructorError(None, None,
-                'expected a mapping node, but found %s' % node.id, node.start_mark)
-
-        mapping = OrderedDict()
-        for key_node, value_node in node.value:
-            key = self.construct_object(key_node, deep=deep)
-            try:
-                hash(key)
-            except TypeError, exc:
-                raise yaml.constructor.ConstructorError('while constructing a mapping',
-                    node.start_mark, 'found unacceptable key (%s)' % exc, key_node.start_mark)
-            value = self.construct_object(value_node, deep=deep)
-            mapping[key] = value
-        return mapping
-
-
 class GimmickBuilder(command.SynctoolsCommand):
     
-    title = 'Gimmick builder'
-    description='convert a gimmicks.txt file into BPM changes and stops'
-    fields = [
-        {
-            'name': 'initialize',
-            'title': 'Create gimmicks.txt skeleton?',
-            'input': command.FieldInputs.boolean,
-            'default': False,
-            'type': command.FieldTypes.yesno,
-        },
-        command.common_fields['backup'],
-    ]
+    title = manifest['gimmickbuilder'].title
+    description = manifest['gimmickbuilder'].description
+    fields = manifest['gimmickbuilder'].fields
+    parallel = True
+    incremental = True
+    # Samples per beat in previews
+    preview_resolution = 48
     
     latest_version = '0.2.0'
     initial_data = """version: {version}
@@ -79,10 +36,26 @@ gimmicks:
 # Add your definitions and gimmicks here
 # See http://grantgarcia.org/synctools/ for more details"""
     
+    def __init__(self, options):
+        super(GimmickBuilder, self).__init__(options)
+        if self.options['preview']:
+            # Previews never touch the simfile, and should be rewritten even
+            # if it hasn't changed
+            self.options['backup'] = False
+            self.incremental = False
+        # BuildCache for each (gimmicks.txt path, version) while watching
+        self.caches = {}
+    
+    def gimmicks_path(self, filename):
+        return os.path.join(os.path.dirname(filename), 'gimmicks.txt')
+    
+    def dependencies(self, filename):
+        return [self.gimmicks_path(filename)]
+    
     def run(self, simfile):
         super(GimmickBuilder, self).run(simfile)
         
-        gpath = os.path.join(os.path.dirname(simfile.filename), 'gimmicks.txt')
+        gpath = self.gimmicks_path(simfile.filename)
         
         # Initialize new gimmicks file
         if self.options['initialize']:
@@ -100,7 +73,7 @@ gimmicks:
         # Parse gimmicks.txt
         self.log.info('Loading gimmicks from file %r' % gpath)
         with open(gpath, 'r') as gfile:
-            g = yaml.load(gfile, Loader=OrderedDictYAMLLoader)
+            g = load_yaml(gfile)
         
         # Determine which parser to use
         if 'version' in g:
@@ -117,10 +90,69 @@ gimmicks:
             self.log.error('GimmickBuilder version %s is unavailable' % ver)
             return
         
-        # Start parsing
-        timing = module.main(g)
+        # Start parsing, reusing the last build of this file if it's being
+        # watched and the version supports it
+        if self.watching and hasattr(module, 'BuildCache'):
+            cache = self.caches.get((gpath, ver))
+            if cache is None:
+                cache = self.caches[gpath, ver] = module.BuildCache()
+            timing = module.main(g, cache)
+        else:
+            timing = module.main(g)
+        if isinstance(timing, TimingStore):
+            timing = timing.to_timing()
+        
+        if self.options['preview']:
+            self.write_preview(simfile, timing)
+            return
+        
+        # Editing a gimmick often leaves the timing as it was, e.g. while
+        # adding a definition that isn't used yet
+        if (list(simfile['BPMS']) == list(timing['BPMS']) and
+                list(simfile['STOPS']) == list(timing['STOPS'])):
+            self.log.debug('Timing is unchanged; not saving')
+            return
         
         # Insert returned data into simfile
         simfile['BPMS'] = timing['BPMS']
         simfile['STOPS'] = timing['STOPS']
-        simfile.save()
\ No newline at end of file
+        self.save(simfile)
+    
+    def done(self):
+        self.caches.clear()
+        super(GimmickBuilder, self).done()
+    
+    def write_preview(self, simfile, timing):
+        """
+        Sample the compiled timing with TimingEngine.preview() and write it
+        next to the simfile as CSV or as NumPy arrays (.npz), leaving the
+        simfile itself alone.
+        """
+        filename = os.path.join(os.path.dirname(simfile.filename),
+                                self.options['preview'])
+        npz = filename.lower().endswith('.npz')
+        if npz and not numpy:
+            self.log.error('NumPy is required for .npz previews')
+            return
+        engine = TimingEngine(timing['BPMS'], timing['STOPS'],
+                              -float(simfile['OFFSET']))
+        if self.options['preview_range']:
+            start, end = [float(beat) for beat in
+                          self.options['preview_range'].split('-')]
+        else:
+            start = 0
+            end = max([engine.beats[-1]] +
+                      [note_index(simfile, chart).last_beat
+                       for chart in simfile.charts]) + 1
+        preview = engine.preview(start, end, self.preview_resolution)
+        columns = ('beat', 'seconds', 'bpm', 'effective_bpm')
+        if npz:
+            numpy.savez(filename, **preview)
+        else:
+            with open(filename, 'wb') as output:
+                writer = csv.writer(output)
+                writer.writerow(columns)
+                for row in zip(*[preview[column] for column in columns]):
+                    writer.writerow(['%.6f' % value for value in row])
+        self.log.info('Wrote preview of beats %s-%s to %s' % (start, end,
+                                                              filename))
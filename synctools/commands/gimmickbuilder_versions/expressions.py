@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""
+Safe evaluation of the expressions in gimmick definitions, such as
+``bpm * mul`` or ``60 / (bpm * mul) * ((mul - 1) * len)``.
+
+Each expression is parsed once, checked to contain nothing but numbers,
+the names `bpm`, `mul` and `len`, and arithmetic operators, and compiled.
+Compiled expressions are cached by their source text.
+"""
+import ast
+
+__all__ = ['Expression', 'ExpressionError', 'compile_expression', 'NAMES']
+
+NAMES = ('bpm', 'mul', 'len')
+
+# Node types that may appear in an expression
+_ALLOWED_NODES = (
+    ast.Expression, ast.BinOp, ast.UnaryOp, ast.Num, ast.Name, ast.Load,
+    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.UAdd, ast.USub,
+)
+
+_cache = {}
+
+
+class ExpressionError(ValueError):
+    pass
+
+
+class Expression(object):
+    """
+    A validated, compiled expression. Call it with `bpm`, `mul` and `len`
+    to get its value.
+    """
+
+    def __init__(self, source):
+        self.source = source = str(source).strip()
+        try:
+            tree = ast.parse(source, mode='eval')
+        except SyntaxError:
+            raise ExpressionError('%r: invalid expression' % source)
+        for node in ast.walk(tree):
+            if not isinstance(node, _ALLOWED_NODES):
+                raise ExpressionError('%r: %s is not allowed' % (
+                    source, type(node).__name__))
+            if isinstance(node, ast.Name) and node.id not in NAMES:
+                raise ExpressionError('%r: unknown name %r' % (source,
+                                                                node.id))
+            if isinstance(node, ast.Num) and isinstance(node.n, complex):
+                raise ExpressionError('%r: complex numbers are not allowed' %
+                                      source)
+        # Don't inherit this module's __future__ flags, so that division
+        # behaves the same as it always has in gimmick definitions
+        self.code = compile(tree, '<gimmick expression>', 'eval',
+                            dont_inherit=True)
+
+    def __call__(self, bpm, mul, len):
+        return eval(self.code, {'__builtins__': {}},
+                    {'bpm': bpm, 'mul': mul, 'len': len})
+
+    def __repr__(self):
+        return 'Expression(%r)' % self.source
+
+
+def compile_expression(source):
+    """
+    Return the compiled :class:`Expression` for `source`, compiling and
+    validating it only the first time it's seen.
+    """
+    try:
+        return _cache[source]
+    except KeyError:
+        expression = _cache[source] = Expression(source)
+        return expression
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+"""
+YAML loading for gimmicks.txt files and the builtin gimmick tables.
+
+Mappings are loaded into ordered dictionaries, since the order of gimmick
+lines matters. Parsing is done by libyaml (PyYAML's CLoader) when it's
+available, which is many times faster than the pure-Python loader; only
+building the Python objects is done in Python.
+"""
+try:
+    from collections import OrderedDict
+except ImportError:
+    from ordereddict import OrderedDict
+
+import yaml
+import yaml.constructor
+try:
+    from yaml import CLoader as Loader
+except ImportError:
+    from yaml import Loader
+
+__all__ = ['OrderedDictYAMLLoader', 'load', 'load_cached']
+
+
+class OrderedDictYAMLLoader(Loader):
+    """
+    A YAML loader that loads mappings into ordered dictionaries.
+    """
+
+    def construct_yaml_map(self, node):
+        data = OrderedDict()
+        yield data
+        value = self.construct_mapping(node)
+        data.update(value)
+
+    def construct_mapping(self, node, deep=False):
+        if isinstance(node, yaml.MappingNode):
+            self.flatten_mapping(node)
+        else:
+            raise yaml.constructor.ConstructorError(None, None,
+                'expected a mapping node, but found %s' % node.id, node.start_mark)
+
+        mapping = OrderedDict()
+        for key_node, value_node in node.value:
+            key = self.construct_object(key_node, deep=deep)
+            try:
+                hash(key)
+            except TypeError, exc:
+                raise yaml.constructor.ConstructorError('while constructing a mapping',
+                    node.start_mark, 'found unacceptable key (%s)' % exc, key_node.start_mark)
+            value = self.construct_object(value_node, deep=deep)
+            mapping[key] = value
+        return mapping
+
+OrderedDictYAMLLoader.add_constructor(u'tag:yaml.org,2002:map',
+    OrderedDictYAMLLoader.construct_yaml_map)
+OrderedDictYAMLLoader.add_constructor(u'tag:yaml.org,2002:omap',
+    OrderedDictYAMLLoader.construct_yaml_map)
+
+
+def load(stream):
+    """
+    Parse a YAML document (a string or file) with mappings in order.
+    """
+    return yaml.load(stream, Loader=OrderedDictYAMLLoader)
+
+
+_cache = {}
+
+def load_cached(source):
+    """
+    Parse a YAML string the first time it's needed and return the same
+    object afterwards. Used for the builtin gimmick tables, which shouldn't
+    be modified.
+    """
+    try:
+        return _cache[source]
+    except KeyError:
+        document = _cache[source] = load(source)
+        return document
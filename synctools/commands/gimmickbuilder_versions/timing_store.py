@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+"""
+The timing builder that every gimmicks.txt format version compiles into.
+
+Version modules add BPM changes and stops to a :class:`TimingStore` as plain
+numbers and return it from their main() function; GimmickBuilder turns it
+into the simfile's BPMS and STOPS.
+"""
+from bisect import bisect_left
+
+from simfile import decimal_from_192nd, Timing
+
+from synctools.timing import from_ticks, to_ticks
+
+__all__ = ['TimingStore']
+
+
+class TimingStore(object):
+    """
+    Holds BPMS and STOPS events sorted by position, with positions quantized
+    to integer 192nd notes. There is at most one event of each type per
+    position; adding another replaces it. Values are kept as floats and only
+    rounded to three decimal places (the only Decimal conversion) when the
+    store is serialized, at which point BPM changes that don't change the
+    rounded BPM are dropped.
+
+    Adding an event appends it to a list of positions and a list of values,
+    which is O(1). Events added out of order (or replacing earlier ones) mark
+    the lists unsorted, and they're sorted and deduplicated in one
+    O(n log n) pass the next time they're read. After that, finding the
+    events in a range of beats is a pair of binary searches.
+    """
+
+    timing_types = ('BPMS', 'STOPS')
+
+    def __init__(self, record=False):
+        # If `record` is true, every add_ticks() call is kept in order, so
+        # that the same events can be replayed into another store
+        self.log = [] if record else None
+        self.ticks = dict((timing_type, []) for timing_type in
+                          self.timing_types)
+        self.values = dict((timing_type, []) for timing_type in
+                           self.timing_types)
+        self.unsorted = set()
+
+    def __len__(self):
+        return sum(len(self.sorted(timing_type)[0])
+                   for timing_type in self.timing_types)
+
+    def add(self, timing_type, beat, value):
+        """
+        Add an event at `beat`, replacing any event of the same type already
+        there. Returns the stored value.
+        """
+        return self.add_ticks(timing_type, to_ticks(beat), float(value))
+
+    def add_ticks(self, timing_type, tick, value):
+        if self.log is not None:
+            self.log.append((timing_type, tick, value))
+        ticks = self.ticks[timing_type]
+        if ticks and tick <= ticks[-1]:
+            self.unsorted.add(timing_type)
+        ticks.append(tick)
+        self.values[timing_type].append(value)
+        return value
+
+    def sorted(self, timing_type):
+        """
+        Return the lists of positions and values of the given type, sorting
+        them first if events were added out of order. Where several events
+        share a position, the one added last wins.
+        """
+        if timing_type in self.unsorted:
+            latest = dict(zip(self.ticks[timing_type],
+                              self.values[timing_type]))
+            ticks = self.ticks[timing_type] = sorted(latest)
+            self.values[timing_type] = [latest[tick] for tick in ticks]
+            self.unsorted.discard(timing_type)
+        return self.ticks[timing_type], self.values[timing_type]
+
+    def last(self, timing_type):
+        """
+        Return the last (beat, value) pair of the given type, or None.
+        """
+        ticks, values = self.sorted(timing_type)
+        if not ticks:
+            return None
+        return from_ticks(ticks[-1]), values[-1]
+
+    def range_ticks(self, timing_type, start, end):
+        """
+        Return the (tick, value) pairs for events with start <= beat < end.
+        """
+        ticks, values = self.sorted(timing_type)
+        lo = bisect_left(ticks, to_ticks(start))
+        hi = bisect_left(ticks, to_ticks(end))
+        return zip(ticks[lo:hi], values[lo:hi])
+
+    def range(self, timing_type, start, end):
+        """
+        Return the (beat, value) pairs for events with start <= beat < end.
+        """
+        return [(from_ticks(tick), value) for tick, value in
+                self.range_ticks(timing_type, start, end)]
+
+    def copy(self, start, end, destination):
+        """
+        Copy the events of every type with start <= beat < end so that they
+        start at `destination` instead.
+        """
+        offset = to_ticks(destination) - to_ticks(start)
+        for timing_type in self.timing_types:
+            for tick, value in self.range_ticks(timing_type, start, end):
+                self.add_ticks(timing_type, tick + offset, value)
+
+    def events(self, timing_type):
+        """
+        Return the (beat, value) pairs of the given type in order, as
+        Decimals rounded to three places. BPM changes that don't change the
+        BPM are left out.
+        """
+        events = []
+        last_value = None
+        for tick, value in zip(*self.sorted(timing_type)):
+            value = decimal_from_192nd(value)
+            if timing_type == 'BPMS':
+                if value == last_value:
+                    continue
+                last_value = value
+            events.append((from_ticks(tick), value))
+        return events
+
+    def to_timing(self):
+        """
+        Return a dict mapping BPMS and STOPS to simfile Timing objects.
+        """
+        return dict((timing_type, Timing(','.join(
+            '%s=%s' % event for event in self.events(timing_type))))
+            for timing_type in self.timing_types)
@@ -1,15 +1,15 @@
 #!/usr/bin/env python
 from fractions import Fraction
 
-from simfile import decimal_from_192nd, Timing
-import yaml
-try:
-    from yaml import CLoader as Loader, CDumper as Dumper
-except ImportError:
-    from yaml import Loader, Dumper
+from synctools.commands.gimmickbuilder_versions.expressions import \
+    compile_expression
+from synctools.commands.gimmickbuilder_versions.ordered_yaml import \
+    load_cached
+from synctools.commands.gimmickbuilder_versions.timing_store import \
+    TimingStore
 
 version = '0.1.0'
-builtin_gimmicks = yaml.load("""
+builtin_gimmicks_yaml = """
 stutter:
     bpms:
         0: bpm * mul
@@ -41,7 +41,14 @@ quarterboost:
     bpms:
         0: bpm / ((mul - .75) * (4 / mul))
         0.25: bpm * mul
-    """, Loader=Loader)
+    """
+
+
+def get_builtin_gimmicks():
+    """
+    Return the builtin gimmick definitions, parsing them the first time.
+    """
+    return load_cached(builtin_gimmicks_yaml)
 
 def parse_beats(beats, nextbeats, length):
     if '-' in beats:
@@ -110,56 +117,35 @@ def parse_gimmick(g, t, gimmicks, gimmick, nextgimmick):
     
     if 'definitions' in g and name in g['definitions']:
         definition = g['definitions'][name]
-    elif name in builtin_gimmicks:
-        definition = builtin_gimmicks[name]
+    elif name in get_builtin_gimmicks():
+        definition = get_builtin_gimmicks()[name]
     
     for timing in ('bpms', 'stops'):
         if timing in definition:
             for loc, eq in definition[timing].iteritems():
                 loc = float(loc)
                 pos = start + length * loc
-                val = eval(eq, {
-                    '__builtins__': None,
-                    'mul': mul,
-                    'len': length,
-                    'bpm': g['bpm'],
-                })
-                while decimal_from_192nd(pos) < decimal_from_192nd(stop):
-                    t[timing][pos] = val
+                val = compile_expression(eq)(bpm=g['bpm'], mul=mul,
+                                             len=length)
+                end = round(stop, 3)
+                while round(pos, 3) < end:
+                    t.add(timing.upper(), pos, val)
                     pos += length
             
             if timing == 'bpms':
-                t['bpms'][stop] = g['bpm']
+                t.add('BPMS', stop, g['bpm'])
 
 def main(g):
     # Ensure the BPM is a float, not an integer
     g['bpm'] = float(g['bpm'])
     
     # Convert each gimmick line into a set of BPMs and stops.
-    t = {
-        'bpms': {0: g['bpm']},
-        'stops': {},
-    }
+    t = TimingStore()
+    t.add('BPMS', 0, g['bpm'])
     gimmicks = sorted(((str(a), str(b)) for a, b in g['gimmicks'].iteritems()),
                       key=(lambda t: str(t[0]).split('-')[0]))
     for i, gimmick in enumerate(gimmicks):
         parse_gimmick(g, t, gimmicks, gimmick,
                       gimmicks[i + 1] if i + 1 < len(gimmicks) else None)
     
-    # Sort BPMs and stops
-    last_bpm = None
-    rtn = {}
-    for timing in ('bpms', 'stops'):
-        tlist = []
-        while t[timing]:
-            k = min(t[timing].keys())
-            v = t[timing].pop(k)
-            if timing == 'bpms' and v == last_bpm:
-                continue
-            tlist.append('%s=%s' % (decimal_from_192nd(k),
-                                    decimal_from_192nd(v)))
-            if timing == 'bpms':
-                last_bpm = v
-        rtn[timing.upper()] = Timing(','.join(tlist))
-    
-    return rtn
\ No newline at end of file
+    return t
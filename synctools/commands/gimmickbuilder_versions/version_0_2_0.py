@@ -6,15 +6,15 @@ try:
 except ImportError:
     from ordereddict import OrderedDict
 
-from simfile import decimal_from_192nd, decimal_to_192nd, Timing
-import yaml
-try:
-    from yaml import CLoader as Loader, CDumper as Dumper
-except ImportError:
-    from yaml import Loader, Dumper
+from synctools.commands.gimmickbuilder_versions.expressions import \
+    ExpressionError, compile_expression
+from synctools.commands.gimmickbuilder_versions.ordered_yaml import \
+    load_cached
+from synctools.commands.gimmickbuilder_versions.timing_store import \
+    TimingStore
 
 version = '0.2.0'
-builtin_gimmicks = yaml.load("""
+builtin_gimmicks_yaml = """
 stutter:
     bpms:
         0: bpm * mul
@@ -46,7 +46,14 @@ quarterboost:
     bpms:
         0: bpm / ((mul - .75) * (4 / mul))
         0.25: bpm * mul
-    """, Loader=Loader)
+    """
+
+
+def get_builtin_gimmicks():
+    """
+    Return the builtin gimmick definitions, parsing them the first time.
+    """
+    return load_cached(builtin_gimmicks_yaml)
 
 
 def parse_gimmick_position(pos):
@@ -178,9 +185,16 @@ def parse_gimmick_value(_val, defs):
     # Check def
     def_ = defs.get(val[2])
     if not def_:
-        def_ = builtin_gimmicks.get(val[2])
+        def_ = get_builtin_gimmicks().get(val[2])
     if not def_:
         raise ValueError('%r: nonexistent definition' % _val)
+    # Compile the definition's expressions, which also validates them
+    try:
+        for timing_type in ('bpms', 'stops'):
+            for eq in def_.get(timing_type, {}).itervalues():
+                compile_expression(eq)
+    except ExpressionError as e:
+        raise ValueError('%r: %s' % (_val, e))
     return {
         'type': 'normal',
         'len': len_,
@@ -220,10 +234,39 @@ def parse_gimmick_line(_pos, _val, defs):
     }
 
 
-def parse_gimmick_lines(lines, defs):
+class BuildCache(object):
+    """
+    What main() kept from the last build of one gimmicks.txt file, so that
+    rebuilding it after an edit (see `synctools-cli --watch`) only does the
+    work for the lines that changed: each line's parsed form, the timing
+    events each "normal" gimmick expands to, and the events added by every
+    gimmick up to the first changed line.
+
+    Each build replaces the contents with what that build used, so nothing
+    outlives the edit that made it stale.
+    """
+    
+    def __init__(self):
+        self.lines = {}
+        self.expansions = {}
+        # Key of each gimmick in the last build, and the length of the
+        # timing log and the current BPM after processing it
+        self.keys = []
+        self.checkpoints = []
+        self.log = []
+
+
+def parse_gimmick_lines(lines, defs, cache=None):
     gimmicks = []
+    defs_key = repr(defs)
     for line in lines:
-        next_gimmick = parse_gimmick_line(line[0], line[1], defs)
+        key = (line[0], line[1], defs_key)
+        next_gimmick = cache and cache.lines.get(key)
+        if next_gimmick is None:
+            next_gimmick = parse_gimmick_line(line[0], line[1], defs)
+            next_gimmick['key'] = key
+            if cache:
+                cache.lines[key] = next_gimmick
         # Don't allow gimmicks to intersect
         if gimmicks:
             end = gimmicks[-1]['pos']['end']
@@ -235,28 +278,23 @@ def parse_gimmick_lines(lines, defs):
 
 
 def add_timing(timing, timing_type, pos, val):
-    pos = decimal_from_192nd(decimal_to_192nd(pos))
-    val = decimal_from_192nd(val)
-    if timing_type == 'BPMS' and timing['BPMS']:
-        # Replace BPM change that coincides with the previous BPM change
-        if timing[timing_type][-1][0] == pos:
-            del timing[timing_type][-1]
-        # Don't add BPM change that's equal to the previous BPM value
-        if timing[timing_type][-1][1] == val:
-            return
-    timing[timing_type].append((pos, val))
+    """
+    Add an event to the TimingStore, replacing any event at the same 192nd
+    note. Returns the value as stored.
+    """
+    return timing.add(timing_type, pos, val)
 
 
-def process_gimmick(gimmick, timing, current_bpm):
+def process_gimmick(gimmick, timing, current_bpm, cache=None):
     # BPM changes
     if gimmick['val']['type'] == 'bpm':
         # Must have a BPM change on beat 0
         if not current_bpm:
             assert not gimmick['pos']['start'], 'Initial BPM must be on beat 0'
-        add_timing(timing, 'BPMS', gimmick['pos']['start'],
-                   gimmick['val']['bpm'])
-        # Set current BPM to the BPM that was just parsed + inserted
-        return timing['BPMS'][-1][1]
+        # Set current BPM to the BPM that was just parsed + inserted, as it
+        # will appear in the simfile
+        return round(add_timing(timing, 'BPMS', gimmick['pos']['start'],
+                                gimmick['val']['bpm']), 3)
     
     # Past this point, current_bpm must be defined
     assert current_bpm, 'Need an initial BPM value'
@@ -272,45 +310,58 @@ def process_gimmick(gimmick, timing, current_bpm):
         copy_length = gimmick['pos']['end'] - gimmick['pos']['start']
         source_start = gimmick['val']['source']
         source_end = source_start + copy_length
-        for timing_type in ('BPMS', 'STOPS'):
-            for beat, value in timing[timing_type]:
-                if source_start <= beat < source_end:
-                    timing[timing_type].append((
-                        float(beat) + gimmick['pos']['start'] - source_start,
-                        value
-                    ))
-            
-            if timing_type == 'BPMS':
-                add_timing(timing, 'BPMS', gimmick['pos']['end'], current_bpm)
+        timing.copy(source_start, source_end, gimmick['pos']['start'])
+        add_timing(timing, 'BPMS', gimmick['pos']['end'], current_bpm)
         return
     
-    # "Normal" gimmicks
+    # "Normal" gimmicks only depend on their own line and the current BPM
+    if cache is None:
+        expand_gimmick(gimmick, timing, current_bpm)
+        return
+    key = (gimmick['key'], current_bpm)
+    events = cache.expansions.get(key)
+    if events is None:
+        expansion = TimingStore(record=True)
+        expand_gimmick(gimmick, expansion, current_bpm)
+        events = cache.expansions[key] = expansion.log
+    for timing_type, tick, value in events:
+        timing.add_ticks(timing_type, tick, value)
+
+
+def expand_gimmick(gimmick, timing, current_bpm):
+    """
+    Add the timing events for a "normal" gimmick.
+    """
     for timing_type in ('BPMS', 'STOPS'):
         if timing_type.lower() in gimmick['val']['def']:
+            # Every repetition of the gimmick has the same values, so
+            # evaluate each expression just once
+            values = [(float(loc), compile_expression(eq)(
+                bpm=float(current_bpm),
+                mul=gimmick['val']['mul'],
+                len=gimmick['val']['len'],
+            )) for loc, eq in
+                gimmick['val']['def'][timing_type.lower()].iteritems()]
             pos = gimmick['pos']['start']
-            while (decimal_from_192nd(pos) <
-                   decimal_from_192nd(gimmick['pos']['end'])):
-                for loc, eq in gimmick['val']['def'][timing_type.lower()].iteritems():
-                    val = eval(eq, {
-                        '__builtins__': None,
-                        'mul': gimmick['val']['mul'],
-                        'len': gimmick['val']['len'],
-                        'bpm': float(current_bpm),
-                    })
+            end = round(gimmick['pos']['end'], 3)
+            while round(pos, 3) < end:
+                for loc, val in values:
                     add_timing(timing, timing_type,
-                        pos + gimmick['val']['len'] * float(loc), val)
+                        pos + gimmick['val']['len'] * loc, val)
                 pos += gimmick['val']['len']
             
             if timing_type == 'BPMS':
                 add_timing(timing, 'BPMS', gimmick['pos']['end'], current_bpm)
 
 
-def main(doc):
+def main(doc, cache=None):
+    """
+    Compile a gimmicks.txt document into a TimingStore. If a BuildCache is
+    given, work from the previous build of the same file is reused and the
+    cache is updated for the next one.
+    """
     # Initial timing data
-    timing = {
-        'BPMS': Timing(''),
-        'STOPS': Timing(''),
-    }
+    timing = TimingStore(record=cache is not None)
     
     defs = doc.get('definitions', {})
     
@@ -318,13 +369,39 @@ def main(doc):
     lines = [(str(pos), str(val)) for pos, val in doc['gimmicks'].iteritems()]
     
     # Parse and verify syntax
-    gimmicks = parse_gimmick_lines(lines, defs)
+    gimmicks = parse_gimmick_lines(lines, defs, cache)
     
-    # Convert gimmicks to timing data
+    # Replay the events of the gimmicks before the first changed line
     current_bpm = None
-    for gimmick in gimmicks:
-        new_bpm = process_gimmick(gimmick, timing, current_bpm)
+    unchanged = 0
+    checkpoints = []
+    if cache:
+        keys = [gimmick['key'] for gimmick in gimmicks]
+        while (unchanged < len(keys) and unchanged < len(cache.keys) and
+                keys[unchanged] == cache.keys[unchanged]):
+            unchanged += 1
+        checkpoints = cache.checkpoints[:unchanged]
+        if unchanged:
+            log_length, current_bpm = checkpoints[-1]
+            for event in cache.log[:log_length]:
+                timing.add_ticks(*event)
+    
+    # Convert the rest of the gimmicks to timing data
+    for gimmick in gimmicks[unchanged:]:
+        new_bpm = process_gimmick(gimmick, timing, current_bpm, cache)
         if new_bpm:
             current_bpm = new_bpm
+        if cache:
+            checkpoints.append((len(timing.log), current_bpm))
+    
+    if cache:
+        cache.keys = keys
+        cache.checkpoints = checkpoints
+        cache.log = timing.log
+        cache.lines = dict((key, cache.lines[key]) for key in keys)
+        used = set(keys)
+        cache.expansions = dict((key, events) for key, events in
+                                cache.expansions.iteritems()
+                                if key[0] in used)
     
-    return timing
\ No newline at end of file
+    return timing
@@ -0,0 +1,255 @@
+"""
+Metadata for the built-in commands.
+
+Listing commands or building option forms only needs the specs below, so the
+command modules themselves (along with YAML, audio generation and so on) are
+only imported when a command is actually run. Each command class takes its
+title, description and fields from its spec.
+"""
+from decimal import Decimal
+import os
+
+from synctools.command import (CommandSpec, FieldInputs, FieldTypes,
+                               common_fields)
+
+__all__ = ['manifest', 'beat_range', 'chart_selection', 'preview_path',
+           'report_path', 'sound_folder']
+
+def chart_selection(value):
+    """
+    Validate ClickTrack's chart selection: blank for the hardest chart,
+    "all", or any of a stepstype and difficulty separated by a space (e.g.
+    "dance-single Hard", "dance-double" or "Challenge").
+    """
+    value = ' '.join(value.split())
+    assert len(value.split()) <= 2, 'expecting a stepstype and/or difficulty'
+    return value
+
+def sound_folder(value):
+    """
+    Validate ClickTrack's custom sound folder, which may be blank.
+    """
+    value = os.path.expanduser(value.strip())
+    assert not value or os.path.isdir(value), 'no such folder'
+    return value
+
+def report_path(value):
+    """
+    Validate FixStops' report filename, which must end in .csv or .json.
+    """
+    value = os.path.expanduser(value.strip())
+    assert os.path.splitext(value)[1].lower() in ('.csv', '.json'), \
+        'expecting a .csv or .json file'
+    return value
+
+def preview_path(value):
+    """
+    Validate GimmickBuilder's preview filename, which may be blank or end in
+    .csv or .npz.
+    """
+    value = os.path.expanduser(value.strip())
+    assert not value or \
+        os.path.splitext(value)[1].lower() in ('.csv', '.npz'), \
+        'expecting a .csv or .npz file'
+    return value
+
+def beat_range(value):
+    """
+    Validate a range of beats such as "32-64", which may be blank.
+    """
+    value = ''.join(value.split())
+    if value:
+        start, end = [float(beat) for beat in value.split('-')]
+        assert start < end, 'expecting start < end'
+    return value
+
+manifest = {
+    'adjustoffset': CommandSpec(
+        name='AdjustOffset',
+        module='synctools.commands.adjustoffset',
+        title='Adjust offset',
+        description='tweak offsets for hardware delay and/or personal '
+                    'preference',
+        fields=[
+            {
+                'name': 'amount',
+                'title': 'Seconds to add',
+                'input': FieldInputs.text,
+                'default': '0.000',
+                'type': Decimal,
+            },
+            common_fields['backup'],
+        ],
+    ),
+    'clicktrack': CommandSpec(
+        name='ClickTrack',
+        module='synctools.commands.clicktrack',
+        title='Click track',
+        description='generate a click track WAV file',
+        fields=[
+            {
+                'name': 'metronome',
+                'title': 'Metronome (noise on each beat)',
+                'input': FieldInputs.boolean,
+                'default': True,
+                'type': FieldTypes.yesno,
+            },
+            {
+                'name': 'taps',
+                'title': 'Taps (sine bloop on each tap note)',
+                'input': FieldInputs.boolean,
+                'default': True,
+                'type': FieldTypes.yesno,
+            },
+            {
+                'name': 'mines',
+                'title': 'Mines (square bloop on each mine)',
+                'input': FieldInputs.boolean,
+                'default': True,
+                'type': FieldTypes.yesno,
+            },
+            {
+                'name': 'amplitude',
+                'title': 'Amplitude',
+                'input': FieldInputs.text,
+                'default': 0.8,
+                'type': FieldTypes.between(0, 1, float),
+            },
+            {
+                'name': 'sample_format',
+                'title': 'Sample format (8, 16 or float)',
+                'input': FieldInputs.text,
+                'default': '8',
+                'type': FieldTypes.choice('8', '16', 'float'),
+            },
+            {
+                'name': 'sample_rate',
+                'title': 'Sample rate (Hz)',
+                'input': FieldInputs.text,
+                'default': 44100,
+                'type': FieldTypes.between(8000, 192000),
+            },
+            {
+                'name': 'sounds',
+                'title': 'Folder of custom sounds (metronome.wav, tap.wav '
+                         'and/or mine.wav)',
+                'input': FieldInputs.text,
+                'default': '',
+                'type': sound_folder,
+            },
+            {
+                'name': 'charts',
+                'title': 'Charts (blank for the hardest, "all", or a '
+                         'stepstype and/or difficulty)',
+                'input': FieldInputs.text,
+                'default': '',
+                'type': chart_selection,
+            },
+            common_fields['global_offset'],
+        ],
+    ),
+    'compacttiming': CommandSpec(
+        name='CompactTiming',
+        module='synctools.commands.compacttiming',
+        title='Compact timing',
+        description='rewrite BPM changes and stops with as few events as '
+                    'possible',
+        fields=[
+            {
+                'name': 'tolerance',
+                'title': 'Tolerance (milliseconds)',
+                'input': FieldInputs.text,
+                'default': 1.0,
+                'type': FieldTypes.between(0, 100, float),
+            },
+            {
+                'name': 'notes_only',
+                'title': 'Only keep notes in time (may change scroll '
+                         'effects)?',
+                'input': FieldInputs.boolean,
+                'default': False,
+                'type': FieldTypes.yesno,
+            },
+            common_fields['backup'],
+        ],
+    ),
+    'fixstops': CommandSpec(
+        name='FixStops',
+        module='synctools.commands.fixstops',
+        title='Fix stops',
+        description='mitigate the effects of imprecise rounding in stop '
+                    'values',
+        fields=[
+            {
+                'name': 'analyze',
+                'title': 'Only analyze (write a report, leave simfiles '
+                         'alone)?',
+                'input': FieldInputs.boolean,
+                'default': False,
+                'type': FieldTypes.yesno,
+            },
+            {
+                'name': 'report',
+                'title': 'Report file (.csv or .json)',
+                'input': FieldInputs.text,
+                'default': 'fixstops-report.csv',
+                'type': report_path,
+            },
+            common_fields['backup'],
+        ],
+    ),
+    'gimmickbuilder': CommandSpec(
+        name='GimmickBuilder',
+        module='synctools.commands.gimmickbuilder',
+        title='Gimmick builder',
+        description='convert a gimmicks.txt file into BPM changes and stops',
+        fields=[
+            {
+                'name': 'initialize',
+                'title': 'Create gimmicks.txt skeleton?',
+                'input': FieldInputs.boolean,
+                'default': False,
+                'type': FieldTypes.yesno,
+            },
+            {
+                'name': 'preview',
+                'title': 'Write a scroll preview (.csv or .npz) instead of '
+                         'saving? (blank to save)',
+                'input': FieldInputs.text,
+                'default': '',
+                'type': preview_path,
+            },
+            {
+                'name': 'preview_range',
+                'title': 'Beats to preview (e.g. 32-64; blank for the whole '
+                         'song)',
+                'input': FieldInputs.text,
+                'default': '',
+                'type': beat_range,
+            },
+            common_fields['backup'],
+        ],
+    ),
+    'patch': CommandSpec(
+        name='Patch',
+        module='synctools.commands.patch',
+        title='Length-patch OGG',
+        description='trick In The Groove r21 into accepting long songs',
+        fields=[
+            {
+                'name': 'length',
+                'title': 'Patched length in seconds',
+                'input': FieldInputs.text,
+                'default': 105,
+                'type': FieldTypes.between(0, 600),
+            },
+            {
+                'name': 'backup_audio',
+                'title': 'Back up audio files?',
+                'input': FieldInputs.boolean,
+                'default': True,
+                'type': FieldTypes.yesno,
+            },
+        ],
+    ),
+}
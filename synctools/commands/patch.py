@@ -1,10 +1,10 @@
 #!/usr/bin/env python
 import os
-import shutil
 import struct
 import zlib
 
 from synctools import command
+from synctools.commands.manifest import manifest
 
 __all__ = ['Patch']
 
@@ -14,24 +14,44 @@ bitswap = ''.join([chr(sum([((val >> i) & 1) << (7-i) for i in range(8)]))
 
 class Patch(command.SynctoolsCommand):
     
-    title = 'Length-patch OGG'
-    description = 'trick In The Groove r21 into accepting long songs'
-    fields = [
-        {
-            'name': 'length',
-            'title': 'Patched length in seconds',
-            'input': command.FieldInputs.text,
-            'default': 105,
-            'type': command.FieldTypes.between(0, 600),
-        },
-        {
-            'name': 'backup_audio',
-            'title': 'Back up audio files?',
-            'input': command.FieldInputs.boolean,
-            'default': True,
-            'type': command.FieldTypes.yesno,
-        },
-    ]
+    title = manifest['patch'].title
+    description = manifest['patch'].description
+    fields = manifest['patch'].fields
+    parallel = True
+    
+    # The largest possible OGG page: a 27-byte header, 255 segment sizes
+    # and 255 segments of 255 bytes
+    max_page_size = 27 + 255 + 255 * 255
+    block_size = 4096
+    
+    def find_last_page(self, audiofile, size):
+        """
+        Scan backward from the end of the file, a block at a time, for the
+        last OGG page: a capture pattern followed by version 0 whose page
+        ends exactly at the end of the file. Returns the page's offset and
+        bytes, or None if there isn't one.
+        """
+        tail = ''
+        position = size
+        limit = max(size - self.max_page_size, 0)
+        while position > limit:
+            start = max(position - self.block_size, limit)
+            audiofile.seek(start)
+            block = audiofile.read(position - start)
+            # Patterns that straddle the old and new data are found too
+            end = len(block) + 4
+            tail = block + tail
+            position = start
+            index = tail.rfind('OggS\x00', 0, end)
+            while index != -1:
+                page = tail[index:]
+                if len(page) >= 27:
+                    segments = bytearray(page[27:27 + ord(page[26])])
+                    if (len(segments) == ord(page[26]) and
+                            27 + len(segments) + sum(segments) == len(page)):
+                        return position + index, page
+                index = tail.rfind('OggS\x00', 0, index + 4)
+        return None
     
     def run(self, simfile):
         super(Patch, self).run(simfile)
@@ -42,40 +62,39 @@ class Patch(command.SynctoolsCommand):
             self.log.error('Only OGG is supported')
             return
         
-        # Backup audio
-        if self.options['backup_audio']:
-            shutil.copy2(ogg, ogg + '~')
-        
-        # Get audio data
-        with open(ogg, 'rb') as audiofile:
-            audiodata = audiofile.read()
-        
-        # Find last page by the 4-byte header + version 0 + last page indicator
-        lpindex = audiodata.rfind('OggS\x00')
-        if lpindex == -1:
-            self.log.error('Unable to find last OGG page')
-            return
-        if not ord(audiodata[lpindex + 5]) & 4:
-            self.log.error('There is something very wrong with this OGG')
-            return
-        lp = audiodata[lpindex:]
-        
-        # TODO: don't assume 44.1kHz below
-        # Get original length & insert new length
-        patchlength = self.options['length']
-        oldlength = struct.unpack('<q', lp[6:14])[0]
-        oldlength /= 44100.
-        lp = lp[:6] + struct.pack('<q', patchlength * 44100) + lp[14:]
-        
-        # Insert new CRC sum
-        # Note: Python computes CRC backwards relative to OGG
-        crc = (~zlib.crc32((lp[:22] + '\x00' * 4 + lp[26:]).translate(bitswap), 
-            -1)) & 0xffffffff
-        lp = (lp[:22] + struct.pack('>I', crc).translate(bitswap) + lp[26:])
-        
-        # Write new audio file
-        with open(ogg, 'wb') as audiofile:
-            audiofile.write(audiodata[:lpindex])
-            audiofile.write(lp)
+        with open(ogg, 'r+b') as audiofile:
+            # Find last page by the 4-byte header + version 0 + last page
+            # indicator, reading only the end of the file
+            found = self.find_last_page(audiofile, os.fstat(
+                audiofile.fileno()).st_size)
+            if not found:
+                self.log.error('Unable to find last OGG page')
+                return
+            lpindex, lp = found
+            if not ord(lp[5]) & 4:
+                self.log.error('There is something very wrong with this OGG')
+                return
+            
+            # TODO: don't assume 44.1kHz below
+            # Get original length & insert new length
+            patchlength = self.options['length']
+            oldlength = struct.unpack('<q', lp[6:14])[0]
+            oldlength /= 44100.
+            header = struct.pack('<q', patchlength * 44100) + lp[14:22]
+            
+            # Insert new CRC sum
+            # Note: Python computes CRC backwards relative to OGG
+            crc = (~zlib.crc32((lp[:6] + header + '\x00' * 4 +
+                                lp[26:]).translate(bitswap), -1)) & 0xffffffff
+            header += struct.pack('>I', crc).translate(bitswap)
+            
+            # Journal the bytes being replaced, then overwrite the granule
+            # position and CRC (and the unchanged bytes between them) with a
+            # single write
+            if self.options['backup_audio']:
+                self.journal.record_bytes(self.run_id, self.name, ogg,
+                                          lpindex + 6, lp[6:26])
+            audiofile.seek(lpindex + 6)
+            audiofile.write(header)
         self.log.info('Patched audio length from %s seconds to %s seconds' %
-            (oldlength, patchlength))
\ No newline at end of file
+            (oldlength, patchlength))
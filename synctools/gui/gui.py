@@ -1,6 +1,6 @@
 ﻿# -*- encoding: utf-8 -*-
-import codecs
 import glob
+import itertools
 import logging
 import os
 import pprint
@@ -15,9 +15,8 @@ import gtk
 import gtk.glade
 
 from simfile import Simfile
-from simfile.msd import MSDParser
 
-from synctools import __version__, command, settings, utils
+from synctools import __version__, command, index, settings, utils
 
 class GtkTextViewHandler(logging.Handler):
     
@@ -77,9 +76,9 @@ class SynctoolsGUI:
         return path
     
     def add_simfiles(self, paths):
-        simfile_paths = []
-        for path in paths:
-            simfile_paths.extend(utils.find_simfiles(path))
+        simfile_paths = itertools.chain.from_iterable(
+            utils.iter_simfiles(path) for path in paths
+        )
         simfile_list = self.glade.get_object('simfiles')
         for path in simfile_paths:
             # Don't re-add simfiles that were already added
@@ -90,23 +89,14 @@ class SynctoolsGUI:
                     break
             if already_added:
                 break
-            # Get metadata from the simfiles (without creating Simfile objects)
-            metadata = {'TITLE': None, 'ARTIST': None, 'CREDIT': None}
-            metadata_missing = len(metadata)
-            with codecs.open(path, 'r', encoding='utf-8') as msdfile:
-                for param in MSDParser(msdfile):
-                    if param[0].upper() in metadata:
-                        metadata[param[0].upper()] = ':'.join(param[1:])
-                        metadata_missing -= 1
-                        if not metadata_missing: break
-                    # We're probably not going to find any useful
-                    # parameters once we're down to the charts
-                    elif param[0].upper() == 'NOTES':
-                        break
+            # Get metadata from the index, which only re-reads simfiles that
+            # have changed since they were last seen
+            metadata = self.index.get(path)
             simfile_list.append([metadata['TITLE'], metadata['ARTIST'],
                                   metadata['CREDIT'], path])
             while gtk.events_pending():
                 gtk.main_iteration_do(False)
+        self.index.commit()
     
     def drag_files(self, widget, context, x, y, selection, target_type, timestamp):
         if target_type == SynctoolsGUI.file_uri_target:
@@ -169,10 +159,8 @@ class SynctoolsGUI:
     # Run buttons
     
     def run_button(self, button, command_name):
-        # Get command class
-        for cn, Command in utils.get_commands().items():
-            if command_name == cn:
-                break
+        # Get command class, importing it if this is its first run
+        Command = utils.get_command_specs()[command_name].load()
         
         # Get option fields
         options = {}
@@ -198,7 +186,8 @@ class SynctoolsGUI:
             return
         for item in simfile_list:
             try:
-                command_instance.run(Simfile(item[-1]))
+                command_instance.collect(
+                    command_instance.run(Simfile(item[-1])))
             except Exception:
                 self.error_to_output_window()
         command_instance.done()
@@ -227,18 +216,21 @@ class SynctoolsGUI:
             self.glade.get_object('output_textview')
         ))
         
+        # Open the simfile metadata index
+        self.index = index.SimfileIndex()
+        
         # Populate command combo box
         notebook = self.glade.get_object('command_notebook')
         self.optionfields = {}
         # Create a page for each command
-        for cn, Command in utils.get_commands().items():
+        for cn, spec in utils.get_command_specs().items():
             # Save fields for future access
             self.optionfields[cn] = current_fields = {}
             # Each tab is a Table with the first column used for labels and the
             # second column for inputs.  There's an extra row at the top for
             # the description and one at the bottom for the "Run" button.
-            page = gtk.Table(rows=len(Command.fields)+2, columns=2)
-            for f, field in enumerate(Command.fields):
+            page = gtk.Table(rows=len(spec.fields)+2, columns=2)
+            for f, field in enumerate(spec.fields):
                 page.attach(gtk.Label(field['title']), 0, 1, f + 1, f + 2)
                 if field['input'] == command.FieldInputs.text:
                     # Add text field
@@ -252,12 +244,12 @@ class SynctoolsGUI:
                 page.attach(field_widget, 1, 2, f + 1, f + 2)
                 current_fields[field['name']] = field_widget
             # Add description
-            page.attach(gtk.Label(Command.description), 0, 2, 0, 1)
+            page.attach(gtk.Label(spec.description), 0, 2, 0, 1)
             # Add "Run" button
-            run_button = gtk.Button(Command.title)
+            run_button = gtk.Button(spec.title)
             run_button.connect('clicked', self.run_button, cn)
             page.attach(run_button, 0, 2, f + 2, f + 3, 0, 0, 0, 5)
-            notebook.append_page(page, gtk.Label(Command.title))
+            notebook.append_page(page, gtk.Label(spec.title))
         
         # Allow selection of multiple simfiles
         selection = self.glade.get_object('simfile_tree').get_selection()
@@ -0,0 +1,130 @@
+import codecs
+import hashlib
+import json
+import os
+import re
+import sqlite3
+from StringIO import StringIO
+
+from simfile.msd import MSDParser
+
+from synctools import settings
+
+__all__ = ['SimfileIndex', 'parse_header']
+
+# Header parameters stored for each simfile
+HEADER_FIELDS = ('TITLE', 'ARTIST', 'CREDIT', 'MUSIC', 'OFFSET', 'BPMS',
+                 'STOPS')
+
+# The first five fields of each chart: stepstype, description, difficulty,
+# meter and radar values
+_CHART = re.compile(r'#NOTES\s*:((?:[^:;]*:){5})', re.IGNORECASE)
+_COMMENT = re.compile(r'//[^\n]*')
+
+def parse_header(data):
+    """
+    Parse the raw bytes of a simfile into a dict of header fields, plus a
+    CHARTS list of dicts describing each chart (without its notes).
+
+    Only the text before the first #NOTES is parsed as MSD; the charts are
+    described by their first few fields, so note data is never parsed.
+    """
+    metadata = dict.fromkeys(HEADER_FIELDS)
+    metadata['CHARTS'] = charts = []
+    text = codecs.decode(data, 'utf-8')
+    notes = re.search('#NOTES', text, re.IGNORECASE)
+    header = text[:notes.start()] if notes else text
+    for param in MSDParser(StringIO(header)):
+        key = param[0].upper()
+        if key in metadata and key != 'CHARTS':
+            metadata[key] = ':'.join(param[1:])
+    for match in _CHART.finditer(text, notes.start() if notes else len(text)):
+        fields = [_COMMENT.sub('', field).strip()
+                  for field in match.group(1).split(':')]
+        charts.append({
+            'stepstype': fields[0],
+            'description': fields[1],
+            'difficulty': fields[2],
+            'meter': fields[3],
+        })
+    return metadata
+
+
+class SimfileIndex(object):
+    """
+    A persistent SQLite cache of simfile header fields.
+
+    Entries are keyed by path and are only re-parsed when the file's mtime or
+    size changes, so looking up an unchanged simfile costs a single stat
+    call. Changes are written when `commit` or `close` is called.
+
+    Pass `threaded=True` to use the index from a thread other than the one
+    that created it (one thread at a time).
+    """
+
+    def __init__(self, filename=None, threaded=False):
+        filename = filename or settings.INDEX_PATH
+        directory = os.path.dirname(filename)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        # Allow worker processes to read while another process writes
+        self.db = sqlite3.connect(filename, timeout=30,
+                                  check_same_thread=not threaded)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('''CREATE TABLE IF NOT EXISTS simfiles (
+            path TEXT PRIMARY KEY,
+            mtime REAL NOT NULL,
+            size INTEGER NOT NULL,
+            hash TEXT NOT NULL,
+            metadata TEXT NOT NULL
+        )''')
+
+    def get(self, path):
+        """
+        Get the header fields of a simfile as a dict. Besides the keys in
+        HEADER_FIELDS and CHARTS, HASH holds the SHA-1 digest of the file.
+        """
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        row = self.db.execute(
+            'SELECT mtime, size, hash, metadata FROM simfiles WHERE path = ?',
+            (path,)
+        ).fetchone()
+        if row and row[0] == st.st_mtime and row[1] == st.st_size:
+            metadata = json.loads(row[3])
+            metadata['HASH'] = row[2]
+            return metadata
+        return self.update(path, st)
+
+    def update(self, path, st=None):
+        """
+        Re-parse a simfile and store its header fields, regardless of whether
+        the cached entry is up to date.
+        """
+        path = os.path.abspath(path)
+        st = st or os.stat(path)
+        with open(path, 'rb') as simfile:
+            data = simfile.read()
+        digest = hashlib.sha1(data).hexdigest()
+        metadata = parse_header(data)
+        self.db.execute(
+            'INSERT OR REPLACE INTO simfiles VALUES (?, ?, ?, ?, ?)',
+            (path, st.st_mtime, st.st_size, digest, json.dumps(metadata))
+        )
+        metadata['HASH'] = digest
+        return metadata
+
+    def forget(self, path):
+        """
+        Remove a simfile from the index.
+        """
+        self.db.execute('DELETE FROM simfiles WHERE path = ?',
+                        (os.path.abspath(path),))
+
+    def commit(self):
+        self.db.commit()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
@@ -0,0 +1,173 @@
+import codecs
+import itertools
+import json
+import logging
+import os
+import re
+import time
+from StringIO import StringIO
+
+from simfile.msd import MSDParser
+
+from synctools import settings
+
+__all__ = ['Journal', 'header_tags', 'new_run_id']
+
+_run_counter = itertools.count(1)
+
+def new_run_id():
+    """
+    Generate an identifier for a run that sorts chronologically. The counter
+    tells apart runs started by the same process in the same second, such as
+    an undo of an undo or several commands run from the GUI.
+    """
+    return '%s-%s-%s' % (time.strftime('%Y%m%d-%H%M%S'), os.getpid(),
+                         next(_run_counter))
+
+def header_tags(text):
+    """
+    Parse the header tags (everything before the first chart) of a simfile's
+    text into a dict mapping uppercase tag names to their raw values.
+    """
+    notes = re.search('#NOTES', text, re.IGNORECASE)
+    if notes:
+        text = text[:notes.start()]
+    return dict((param[0].upper(), ':'.join(param[1:]))
+                for param in MSDParser(StringIO(text)))
+
+def replace_tag(text, tag, value):
+    """
+    Replace the value of a header tag in a simfile's text. The tag is
+    removed if `value` is None and added before the first chart if missing.
+    """
+    if value is None:
+        # Also remove the line break that adding the tag would insert
+        return re.sub(r'#%s:[^;]*;\r?\n?' % re.escape(tag), '', text, 1,
+                      re.IGNORECASE)
+    pattern = re.compile(r'#%s:[^;]*;' % re.escape(tag), re.IGNORECASE)
+    replacement = u'#%s:%s;' % (tag, value)
+    if pattern.search(text):
+        # Use a function so that backslashes in the value are left alone
+        return pattern.sub(lambda match: replacement, text, 1)
+    notes = re.search('#NOTES', text, re.IGNORECASE)
+    position = notes.start() if notes else len(text)
+    return text[:position] + replacement + u'\n' + text[position:]
+
+
+class Journal(object):
+    """
+    An append-only log of the header tags that each run changed.
+
+    Every line is a JSON object holding the run ID, the command name, the
+    simfile's path and the previous value of each tag the run changed (None
+    for tags that didn't exist), which is all that's needed to undo a run.
+    Commands that patch other files in place, such as Patch, journal the
+    original bytes instead, as a path, an offset and hex-encoded data.
+    """
+
+    def __init__(self, filename=None):
+        self.filename = filename or settings.JOURNAL_PATH
+        self.log = logging.getLogger('synctools')
+
+    def record(self, run_id, command, path, tags):
+        """
+        Append the previous values of a simfile's changed tags.
+        """
+        self._append({
+            'run': run_id,
+            'command': command,
+            'path': os.path.abspath(path),
+            'tags': tags,
+        })
+
+    def record_bytes(self, run_id, command, path, offset, data):
+        """
+        Append the original bytes of a file that's about to be overwritten
+        in place, starting at `offset`.
+        """
+        self._append({
+            'run': run_id,
+            'command': command,
+            'path': os.path.abspath(path),
+            'offset': offset,
+            'bytes': data.encode('hex'),
+        })
+
+    def _append(self, entry):
+        directory = os.path.dirname(self.filename)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        line = json.dumps(entry) + '\n'
+        # A single write of a single line, so concurrent runs don't mix
+        with open(self.filename, 'a') as journal:
+            journal.write(line)
+
+    def entries(self, run_id=None):
+        """
+        Yield the journal's entries in the order they were recorded,
+        optionally limited to a single run.
+        """
+        if not os.path.exists(self.filename):
+            return
+        with open(self.filename, 'r') as journal:
+            for line in journal:
+                # Cheap check before parsing the line
+                if run_id and run_id not in line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if not run_id or entry['run'] == run_id:
+                    yield entry
+
+    def runs(self):
+        """
+        Return a list of (run ID, command, number of files) tuples.
+        """
+        runs = {}
+        order = []
+        for entry in self.entries():
+            if entry['run'] not in runs:
+                runs[entry['run']] = [entry['command'], 0]
+                order.append(entry['run'])
+            runs[entry['run']][1] += 1
+        return [(run_id,) + tuple(runs[run_id]) for run_id in order]
+
+    def undo(self, run_id):
+        """
+        Restore every tag (or byte) changed by the given run. The values
+        being replaced are themselves journaled under a new run ID, which is
+        returned.
+        """
+        undo_id = new_run_id()
+        count = 0
+        for entry in reversed(list(self.entries(run_id))):
+            path = entry['path']
+            if not os.path.exists(path):
+                self.log.warning('%s no longer exists' % path)
+                continue
+            if 'bytes' in entry:
+                data = entry['bytes'].decode('hex')
+                with open(path, 'r+b') as patched:
+                    patched.seek(entry['offset'])
+                    replaced = patched.read(len(data))
+                    patched.seek(entry['offset'])
+                    patched.write(data)
+                self.record_bytes(undo_id, 'undo %s' % run_id, path,
+                                  entry['offset'], replaced)
+                count += 1
+                continue
+            with codecs.open(path, 'r', encoding='utf-8') as sm:
+                text = sm.read()
+            current = header_tags(text)
+            replaced = {}
+            for tag, value in entry['tags'].items():
+                replaced[tag] = current.get(tag)
+                text = replace_tag(text, tag, value)
+            with codecs.open(path, 'w', encoding='utf-8') as sm:
+                sm.write(text)
+            self.record(undo_id, 'undo %s' % run_id, path, replaced)
+            count += 1
+        self.log.info('Restored %s files' % count)
+        return undo_id
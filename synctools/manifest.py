@@ -0,0 +1,105 @@
+import hashlib
+import os
+
+from synctools import settings
+from synctools.index import SimfileIndex
+
+__all__ = ['RunManifest']
+
+class RunManifest(object):
+    """
+    Records, for each simfile a command has processed, the state of its
+    inputs before and after the run, so that later runs of an incremental
+    command with the same options can skip simfiles that haven't changed
+    since.
+
+    A simfile's state is the content hash of the simfile (looked up through
+    the simfile index) combined with the contents of any files listed by the
+    command's `dependencies` method.
+    """
+
+    def __init__(self, filename=None):
+        self.filename = filename or settings.INDEX_PATH
+        self.index = SimfileIndex(self.filename)
+        self.db = self.index.db
+        self.db.execute('''CREATE TABLE IF NOT EXISTS manifest (
+            path TEXT NOT NULL,
+            command TEXT NOT NULL,
+            options TEXT NOT NULL,
+            input_hash TEXT NOT NULL,
+            output_hash TEXT NOT NULL,
+            PRIMARY KEY (path, command, options)
+        )''')
+
+    @staticmethod
+    def _key(command_instance, path):
+        return (
+            os.path.abspath(path),
+            command_instance.name,
+            repr(sorted(command_instance.options.items())),
+        )
+
+    def state_hash(self, command_instance, path, fresh=False):
+        """
+        Hash the simfile together with the command's dependencies for it. If
+        `fresh` is True, the simfile is re-read even if its index entry looks
+        up to date.
+        """
+        if fresh:
+            metadata = self.index.update(path)
+        else:
+            metadata = self.index.get(path)
+        state = hashlib.sha1(metadata['HASH'])
+        for dependency in command_instance.dependencies(path):
+            state.update('\0' + dependency + '\0')
+            if os.path.isfile(dependency):
+                with open(dependency, 'rb') as dependency_file:
+                    state.update(dependency_file.read())
+        return state.hexdigest()
+
+    def is_current(self, command_instance, path, state=None):
+        """
+        Check whether the simfile is in exactly the state the command left it
+        in the last time it ran with the same options.
+        """
+        row = self.db.execute(
+            'SELECT output_hash FROM manifest '
+            'WHERE path = ? AND command = ? AND options = ?',
+            self._key(command_instance, path)
+        ).fetchone()
+        if not row:
+            return False
+        if state is None:
+            state = self.state_hash(command_instance, path)
+        return row[0] == state
+
+    def check(self, command_instance, path, force=False):
+        """
+        Return the current state hash of the simfile if it needs to be
+        processed, or None if it is current and `force` is False.
+        """
+        state = self.state_hash(command_instance, path)
+        if not force and self.is_current(command_instance, path, state):
+            return None
+        return state
+
+    def record(self, command_instance, path, input_hash):
+        """
+        Record the state of a simfile after the command has processed it.
+        `input_hash` is the state returned by check() before the run.
+        """
+        # The simfile may have been rewritten within the resolution of its
+        # mtime, so don't trust the index here
+        output_hash = self.state_hash(command_instance, path, fresh=True)
+        self.db.execute(
+            'INSERT OR REPLACE INTO manifest VALUES (?, ?, ?, ?, ?)',
+            self._key(command_instance, path) + (input_hash, output_hash)
+        )
+        # Commit right away so that worker processes aren't kept waiting
+        self.commit()
+
+    def commit(self):
+        self.db.commit()
+
+    def close(self):
+        self.index.close()
@@ -0,0 +1,112 @@
+"""
+A compact, array-backed index of a chart's notes.
+"""
+from array import array
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+__all__ = ['NoteIndex', 'note_index', 'TAP', 'HOLD', 'TAIL', 'ROLL', 'MINE',
+           'LIFT', 'FAKE', 'HEADS']
+
+# One bit per note type
+TAP, HOLD, TAIL, ROLL, MINE, LIFT, FAKE = [1 << i for i in xrange(7)]
+# Anything that starts a note the player has to hit
+HEADS = TAP | HOLD | ROLL
+
+NOTE_BITS = {'1': TAP, '2': HOLD, '3': TAIL, '4': ROLL, 'M': MINE, 'L': LIFT,
+             'F': FAKE}
+# Translation table from note characters to their bits
+_TABLE = ''.join(chr(NOTE_BITS.get(chr(i), 0)) for i in xrange(256))
+
+
+class NoteIndex(object):
+    """
+    Stores a chart's rows as a column of beats (as floats) plus one
+    note-type code per column, where each code is one of the bits above, and
+    the bitwise OR of each row's codes. These are NumPy arrays if NumPy is
+    available and `array.array` objects otherwise, taking a few bytes per
+    row instead of a (beat, string) tuple.
+
+    Rows with a different number of columns than the first row (which
+    shouldn't happen in a well-formed chart) are padded or truncated.
+    """
+
+    def __init__(self, notes):
+        rows = [row for beat, row in notes]
+        self.columns = len(rows[0]) if rows else 0
+        width = self.columns
+        text = ''.join(row[:width].ljust(width, '0') for row in rows)
+        if isinstance(text, unicode):
+            text = text.encode('ascii', 'replace')
+        codes = text.translate(_TABLE)
+        if numpy:
+            self.beats = numpy.array([float(beat) for beat, row in notes])
+            self.codes = numpy.frombuffer(codes, numpy.uint8).reshape(
+                (len(rows), width))
+            if width:
+                self.masks = numpy.bitwise_or.reduce(self.codes, axis=1)
+            else:
+                self.masks = numpy.zeros(len(rows), numpy.uint8)
+        else:
+            self.beats = array('d', (float(beat) for beat, row in notes))
+            self.codes = array('B', codes)
+            self.masks = array('B', (
+                reduce(int.__or__, self.codes[i:i + width], 0)
+                for i in xrange(0, len(codes), width or 1)))
+
+    def __len__(self):
+        return len(self.beats)
+
+    def rows_with(self, bits):
+        """
+        Return the indices of the rows that have any of the note types in
+        `bits`.
+        """
+        if numpy:
+            return numpy.flatnonzero(self.masks & bits)
+        return [i for i, mask in enumerate(self.masks) if mask & bits]
+
+    def beats_with(self, bits):
+        """
+        Return the beats of the rows that have any of the note types in
+        `bits`, e.g. ``beats_with(MINE)`` or ``beats_with(TAP | LIFT)``.
+        """
+        if numpy:
+            return self.beats[(self.masks & bits) != 0]
+        return array('d', (beat for beat, mask in zip(self.beats, self.masks)
+                           if mask & bits))
+
+    def count(self, bits):
+        """
+        Return the number of notes of the types in `bits`, counting each
+        column separately.
+        """
+        if numpy:
+            return int(numpy.count_nonzero(self.codes & bits))
+        return sum(1 for code in self.codes if code & bits)
+
+    def column(self, index):
+        """
+        Return the note codes of a single column.
+        """
+        if numpy:
+            return self.codes[:, index]
+        return self.codes[index::self.columns]
+
+    @property
+    def last_beat(self):
+        return self.beats[-1] if len(self.beats) else 0.
+
+
+def note_index(simfile, chart):
+    """
+    Return the :class:`NoteIndex` for one of the simfile's charts, building
+    it the first time and caching it on the simfile afterwards.
+    """
+    cache = simfile.__dict__.setdefault('_note_indexes', {})
+    cached = cache.get(id(chart))
+    if cached is None or cached[0] is not chart:
+        cached = cache[id(chart)] = (chart, NoteIndex(chart.notes))
+    return cached[1]
@@ -0,0 +1,92 @@
+from synctools.command import SynctoolsCommand
+
+__all__ = ['Pipeline']
+
+class Pipeline(SynctoolsCommand):
+    """
+    Runs several commands over each simfile in turn, passing the same Simfile
+    object to each command's run() and saving it once at the end.
+
+    `commands` is a list of (command class, options) pairs. The pipeline
+    backs up the simfile if any of its commands would, and it is parallel-
+    safe or incremental only if all of its commands are. Every command
+    journals its changes under the pipeline's run ID.
+    """
+
+    def __init__(self, commands):
+        self.recipe = commands
+        self.commands = [Command(options) for Command, options in commands]
+        super(Pipeline, self).__init__({})
+        for command_instance in self.commands:
+            command_instance.deferred = True
+        self.parallel = all(c.parallel for c in self.commands)
+        self.incremental = all(c.incremental for c in self.commands)
+        # Qualify each command's options with its name, so that the run
+        # manifest can tell pipelines with different options apart
+        for command_instance in self.commands:
+            for key, value in command_instance.options.items():
+                self.options['%s.%s' % (command_instance.name, key)] = value
+        self.options['backup'] = any(c.options.get('backup')
+                                     for c in self.commands)
+
+    @property
+    def name(self):
+        return '+'.join(c.name for c in self.commands)
+
+    @property
+    def run_id(self):
+        return self._run_id
+
+    @run_id.setter
+    def run_id(self, value):
+        # Members that journal on their own, such as Patch, have to do so
+        # under the pipeline's run ID, including in worker processes
+        self._run_id = value
+        for command_instance in self.commands:
+            command_instance.run_id = value
+
+    @property
+    def journaling(self):
+        return any(c.journaling for c in self.commands)
+
+    @property
+    def watching(self):
+        return all(c.watching for c in self.commands)
+
+    @watching.setter
+    def watching(self, value):
+        for command_instance in self.commands:
+            command_instance.watching = value
+
+    def init_args(self):
+        return (self.recipe,)
+
+    def dependencies(self, filename):
+        dependencies = []
+        for command_instance in self.commands:
+            dependencies.extend(command_instance.dependencies(filename))
+        return dependencies
+
+    def run(self, simfile):
+        if self.options['backup']:
+            self.backup(simfile)
+        results = []
+        modified = False
+        for command_instance in self.commands:
+            command_instance.modified = False
+            results.append(command_instance.run(simfile))
+            modified = modified or command_instance.modified
+        if modified:
+            self.save(simfile)
+        return results
+
+    def collect(self, results):
+        # Errors in worker processes produce no results at all
+        if results is None:
+            return
+        for command_instance, result in zip(self.commands, results):
+            command_instance.collect(result)
+
+    def done(self):
+        for command_instance in self.commands:
+            command_instance.done()
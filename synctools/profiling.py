@@ -0,0 +1,243 @@
+import functools
+import json
+import logging
+import os
+import sys
+import time
+try:
+    import resource
+except ImportError:
+    resource = None
+
+__all__ = ['Profiler', 'percentile']
+
+def percentile(values, fraction):
+    """
+    Return the value at the given fraction (0 to 1) of a sorted list.
+    """
+    if not values:
+        return 0.
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+def _cpu_time():
+    user, system = os.times()[:2]
+    return user + system
+
+if sys.platform == 'win32':
+    import ctypes
+    from ctypes import wintypes
+
+    class _ProcessMemoryCounters(ctypes.Structure):
+        _fields_ = [
+            ('cb', wintypes.DWORD),
+            ('PageFaultCount', wintypes.DWORD),
+            ('PeakWorkingSetSize', ctypes.c_size_t),
+            ('WorkingSetSize', ctypes.c_size_t),
+            ('QuotaPeakPagedPoolUsage', ctypes.c_size_t),
+            ('QuotaPagedPoolUsage', ctypes.c_size_t),
+            ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t),
+            ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+            ('PagefileUsage', ctypes.c_size_t),
+            ('PeakPagefileUsage', ctypes.c_size_t),
+        ]
+
+    def _win32_memory():
+        counters = _ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        try:
+            process = ctypes.windll.kernel32.GetCurrentProcess()
+            ok = ctypes.windll.psapi.GetProcessMemoryInfo(
+                ctypes.c_void_p(process), ctypes.byref(counters),
+                counters.cb)
+        except (AttributeError, OSError):
+            return None, None
+        if not ok:
+            return None, None
+        return (counters.WorkingSetSize // 1024,
+                counters.PeakWorkingSetSize // 1024)
+
+def _memory():
+    """
+    Return the process's current and peak resident set size in kilobytes.
+    Either may be None where it can't be read cheaply; Mac OS X has no
+    /proc to read the current size from.
+    """
+    if sys.platform == 'win32':
+        return _win32_memory()
+    peak = None
+    if resource:
+        # ru_maxrss is in kilobytes on Linux but bytes on Mac OS X
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform == 'darwin':
+            peak //= 1024
+    try:
+        with open('/proc/self/statm') as statm:
+            pages = int(statm.read().split()[1])
+    except (IOError, OSError, IndexError, ValueError):
+        return None, peak
+    return pages * (os.sysconf('SC_PAGE_SIZE') // 1024), peak
+
+def _largest(*sizes):
+    known = [size for size in sizes if size is not None]
+    return max(known) if known else None
+
+def _peak_between(start, end):
+    """
+    Return the peak resident set size in kilobytes between two _memory()
+    samples, or None if it can't be determined.
+
+    If the process's peak grew in between, the new peak was reached in
+    between, so it's exact. Otherwise the larger of the two current sizes
+    is used, which is a lower bound.
+    """
+    (current_start, peak_start), (current_end, peak_end) = start, end
+    if peak_start is not None and peak_end is not None and \
+            peak_end > peak_start:
+        return peak_end
+    return _largest(current_start, current_end)
+
+
+class Profiler(object):
+    """
+    Records wall time, CPU time and peak memory for each phase of each
+    simfile a command processes: parsing the simfile, and the command's
+    backup(), run() and save() methods.
+
+    Phase times exclude nested phases, so "run" is the time spent in run()
+    outside of backup() and save(). Memory is the peak resident set size
+    during each phase (including nested phases) and during each simfile as
+    a whole, sampled at their boundaries; see _peak_between(). Each
+    simfile's record is written as a line of JSON to `trace`, if given.
+    """
+
+    phases = ('parse', 'backup', 'run', 'save')
+
+    def __init__(self, trace=None, memory=True):
+        self.log = logging.getLogger('synctools')
+        self.trace = trace and open(trace, 'w')
+        self.memory = memory
+        self.records = []
+        self.current = None
+        self.stack = []
+
+    def instrument(self, command_instance):
+        """
+        Time the backup(), run() and save() methods of a command instance.
+        """
+        for phase in ('backup', 'run', 'save'):
+            setattr(command_instance, phase,
+                    self.timed(phase, getattr(command_instance, phase)))
+
+    def timed(self, phase, function):
+        """
+        Wrap a function so that calls to it are recorded under `phase`.
+        """
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if self.current is None:
+                return function(*args, **kwargs)
+            self.enter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.exit(phase)
+        return wrapper
+
+    def sample(self):
+        return _memory() if self.memory else (None, None)
+
+    def enter(self):
+        # [wall start, cpu start, wall in children, cpu in children,
+        #  memory at start, peak memory in children]
+        self.stack.append([time.time(), _cpu_time(), 0., 0., self.sample(),
+                           None])
+
+    def leave(self):
+        """
+        Pop the innermost phase and return its wall time, CPU time and peak
+        memory.
+        """
+        (wall_start, cpu_start, wall_children, cpu_children, memory_start,
+         peak_children) = self.stack.pop()
+        wall = time.time() - wall_start
+        cpu = _cpu_time() - cpu_start
+        peak_kb = _largest(_peak_between(memory_start, self.sample()),
+                           peak_children)
+        if self.stack:
+            self.stack[-1][2] += wall
+            self.stack[-1][3] += cpu
+            self.stack[-1][5] = _largest(self.stack[-1][5], peak_kb)
+        return wall - wall_children, cpu - cpu_children, wall, cpu, peak_kb
+
+    def exit(self, phase):
+        wall, cpu, _, _, peak_kb = self.leave()
+        totals = self.current['phases'].setdefault(
+            phase, {'wall': 0., 'cpu': 0.})
+        totals['wall'] += wall
+        totals['cpu'] += cpu
+        if peak_kb is not None:
+            totals['peak_kb'] = _largest(totals.get('peak_kb'), peak_kb)
+
+    def start(self, path):
+        """
+        Begin recording a simfile.
+        """
+        self.current = {'path': path, 'phases': {}}
+        self.enter()
+
+    def stop(self):
+        """
+        Finish recording the current simfile and return its record.
+        """
+        record = self.current
+        _, _, record['wall'], record['cpu'], peak_kb = self.leave()
+        if peak_kb is not None:
+            record['peak_kb'] = peak_kb
+        self.current = None
+        self.stack = []
+        self.records.append(record)
+        if self.trace:
+            self.trace.write(json.dumps(record) + '\n')
+            self.trace.flush()
+        return record
+
+    def summary(self, slowest=10):
+        """
+        Log percentiles for each phase and the slowest simfiles.
+        """
+        if not self.records:
+            return
+        self.log.info('Profiled %s simfiles in %.3f seconds' % (
+            len(self.records), sum(r['wall'] for r in self.records)))
+        self.log.info('%-8s %9s %9s %9s %9s %10s %10s' % (
+            'phase', 'p50', 'p90', 'p99', 'max', 'total', 'peak'))
+        for phase in self.phases + ('total',):
+            if phase == 'total':
+                totals = self.records
+            else:
+                totals = [r['phases'][phase] for r in self.records
+                          if phase in r['phases']]
+            if not totals:
+                continue
+            walls = sorted(t['wall'] for t in totals)
+            peaks = [t['peak_kb'] for t in totals if 'peak_kb' in t]
+            self.log.info('%-8s %8.1fms %8.1fms %8.1fms %8.1fms %9.3fs '
+                          '%10s' % (
+                phase,
+                percentile(walls, .5) * 1000,
+                percentile(walls, .9) * 1000,
+                percentile(walls, .99) * 1000,
+                walls[-1] * 1000,
+                sum(walls),
+                '%d KB' % max(peaks) if peaks else '-',
+            ))
+        self.log.info('Slowest simfiles:')
+        for record in sorted(self.records, key=lambda r: r['wall'],
+                             reverse=True)[:slowest]:
+            self.log.info('%8.1fms %s' % (record['wall'] * 1000,
+                                          record['path']))
+
+    def close(self):
+        if self.trace:
+            self.trace.close()
+            self.trace = None
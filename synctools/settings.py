@@ -1 +1,9 @@
-COMMANDS = ['adjustoffset', 'clicktrack', 'fixstops', 'gimmickbuilder', 'patch']
\ No newline at end of file
+import os
+
+COMMANDS = ['adjustoffset', 'clicktrack', 'compacttiming', 'fixstops',
+            'gimmickbuilder', 'patch']
+
+# Per-user storage for the simfile index and other persistent data
+DATA_DIR = os.path.join(os.path.expanduser('~'), '.synctools')
+INDEX_PATH = os.path.join(DATA_DIR, 'index.db')
+JOURNAL_PATH = os.path.join(DATA_DIR, 'journal.jsonl')
\ No newline at end of file
@@ -0,0 +1,146 @@
+"""
+Click sounds for ClickTrack: generated metronome, tap and mine sounds, or
+user-supplied WAV samples, cached for the life of the process.
+"""
+from array import array
+import math
+import os
+import random
+import sys
+import wave
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+__all__ = ['SoundBank', 'bank', 'generators', 'load_wav', 'resample']
+
+# The generated sounds were designed as 1024 samples at 44100 Hz
+BASE_RATE = 44100
+BASE_LENGTH = 1024
+
+def _envelope(amplitude, sample_rate):
+    """
+    Yield (amplitude, position) pairs for a linear fade-out, where position
+    counts down in 44100 Hz samples regardless of the sample rate.
+    """
+    length = int(round(BASE_LENGTH * sample_rate / float(BASE_RATE)))
+    for b in xrange(length, 0, -1):
+        yield amplitude * b / float(length), b * float(BASE_RATE) / sample_rate
+
+def metronome(amplitude, sample_rate):
+    """White noise."""
+    return [random.uniform(-1, 1) * a
+            for a, b in _envelope(amplitude, sample_rate)]
+
+def tap(amplitude, sample_rate):
+    """A sine bloop."""
+    return [math.sin(b / 4.) * a for a, b in _envelope(amplitude, sample_rate)]
+
+def mine(amplitude, sample_rate):
+    """A square bloop."""
+    return [(int(b / 128) % 2 * 2 - 1) * a
+            for a, b in _envelope(amplitude, sample_rate)]
+
+generators = {
+    'metronome': metronome,
+    'tap': tap,
+    'mine': mine,
+}
+
+
+def load_wav(filename):
+    """
+    Read an 8, 16 or 32-bit PCM WAV file and return its samples (mixed down
+    to mono, between -1 and 1) and its sample rate.
+    """
+    wav = wave.open(filename, 'rb')
+    try:
+        channels = wav.getnchannels()
+        width = wav.getsampwidth()
+        rate = wav.getframerate()
+        data = wav.readframes(wav.getnframes())
+    finally:
+        wav.close()
+    if width == 1:
+        samples = [(value - 128) / 128. for value in bytearray(data)]
+    elif width in (2, 4):
+        ints = array('h' if width == 2 else 'i')
+        ints.fromstring(data)
+        if sys.byteorder == 'big':
+            ints.byteswap()
+        scale = float(2 ** (width * 8 - 1))
+        samples = [value / scale for value in ints]
+    else:
+        raise ValueError('%s: unsupported sample width %s' % (filename,
+                                                             width))
+    if channels > 1:
+        samples = [sum(samples[i:i + channels]) / channels
+                   for i in xrange(0, len(samples), channels)]
+    return samples, rate
+
+def resample(samples, from_rate, to_rate):
+    """
+    Resample a sound with linear interpolation.
+    """
+    if from_rate == to_rate or not samples:
+        return list(samples)
+    length = max(int(round(len(samples) * to_rate / float(from_rate))), 1)
+    step = from_rate / float(to_rate)
+    if numpy:
+        return list(numpy.interp(numpy.arange(length) * step,
+                                 numpy.arange(len(samples)), samples))
+    resampled = []
+    last = len(samples) - 1
+    for i in xrange(length):
+        position = i * step
+        j = min(int(position), last)
+        k = min(j + 1, last)
+        fraction = position - j
+        resampled.append(samples[j] * (1 - fraction) + samples[k] * fraction)
+    return resampled
+
+
+class SoundBank(object):
+    """
+    Builds click sounds on demand and remembers them. Generated sounds are
+    keyed by (kind, amplitude, sample rate); sounds loaded from WAV files
+    are also keyed by the file's path, size and modification time, so they
+    are only read and resampled again when the file changes.
+
+    Sounds are returned as NumPy arrays when NumPy is available, otherwise
+    as lists of floats. Use the shared `bank` so that every command instance
+    in a process reuses the same sounds.
+    """
+
+    def __init__(self):
+        self.cache = {}
+
+    def get(self, kind, amplitude, sample_rate, filename=None):
+        """
+        Return the sound for `kind` ("metronome", "tap" or "mine"), read from
+        `filename` if given and generated otherwise.
+        """
+        if filename:
+            st = os.stat(filename)
+            key = (kind, amplitude, sample_rate, os.path.abspath(filename),
+                   st.st_size, st.st_mtime)
+        else:
+            key = (kind, amplitude, sample_rate)
+        if key not in self.cache:
+            if filename:
+                samples, rate = load_wav(filename)
+                sound = [sample * amplitude for sample in
+                         resample(samples, rate, sample_rate)]
+            else:
+                sound = generators[kind](amplitude, sample_rate)
+            if numpy:
+                sound = numpy.array(sound)
+            self.cache[key] = sound
+        return self.cache[key]
+
+    def clear(self):
+        self.cache.clear()
+
+
+bank = SoundBank()
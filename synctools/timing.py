@@ -0,0 +1,369 @@
+"""
+Conversion between beats and seconds for a simfile's BPMS and STOPS, and
+between beats and the integer 192nd-note ticks that timing is quantized to.
+"""
+from bisect import bisect_right
+from decimal import Decimal
+import math
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from simfile import decimal_from_192nd
+
+__all__ = ['TimingEngine', 'compact', 'to_ticks', 'from_ticks']
+
+TICKS_PER_BEAT = 48
+
+def to_ticks(beat):
+    """
+    Quantize a beat to an integer number of 192nd notes.
+    """
+    return int(round(float(beat) * TICKS_PER_BEAT))
+
+_beats = {}
+
+def from_ticks(ticks):
+    """
+    Convert a number of 192nd notes back to a beat, rounded to three decimal
+    places like every other value in a simfile. Results are cached, since
+    formatting Decimals is slow and the same positions come up repeatedly.
+    """
+    try:
+        return _beats[ticks]
+    except KeyError:
+        beat = _beats[ticks] = decimal_from_192nd(float(ticks) /
+                                                  TICKS_PER_BEAT)
+        return beat
+
+
+class TimingEngine(object):
+    """
+    Precomputes the elapsed time at every BPM change and stop so that beats
+    can be converted to seconds (and back) with a binary search instead of a
+    walk over every timing event.
+
+    `bpms` and `stops` are sequences of (beat, value) pairs, such as the
+    simfile's BPMS and STOPS. Beat 0 is at `offset` seconds; pass the negated
+    OFFSET tag to get times relative to the start of the music. Events before
+    beat 0 come before it, so they don't move it. Like StepMania, a stop at a
+    given beat delays everything *after* that beat, so a note on the stop's
+    beat is hit when the stop starts.
+
+    Converting seconds to beats assumes that time always moves forward, i.e.
+    that there are no negative BPMs or stops.
+    """
+
+    def __init__(self, bpms, stops=(), offset=0):
+        if not bpms:
+            raise ValueError('at least one BPM is required')
+        events = {}
+        for beat, bpm in bpms:
+            events.setdefault(float(beat), [None, 0.])[0] = float(bpm)
+        for beat, stop in stops:
+            events.setdefault(float(beat), [None, 0.])[1] += float(stop)
+        # One segment per timing event, starting on the event's beat
+        self.beats = []
+        self.seconds = []
+        self.stops = []
+        self.spb = []
+        seconds = float(offset)
+        # Stops before the first BPM use the first BPM
+        spb = 60. / float(min(bpms, key=lambda pair: float(pair[0]))[1])
+        for beat in sorted(events):
+            bpm, stop = events[beat]
+            if self.beats:
+                seconds += self.stops[-1] + (beat - self.beats[-1]) * spb
+            if bpm is not None:
+                spb = 60. / bpm
+            self.beats.append(beat)
+            self.seconds.append(seconds)
+            self.stops.append(stop)
+            self.spb.append(spb)
+        # Elapsed time once each segment's stop has finished
+        self.resumes = [s + stop for s, stop in zip(self.seconds, self.stops)]
+        # The walk started at the first event; move beat 0 to the offset
+        shift = float(offset) - self.seconds_at(0)
+        if shift:
+            self.seconds = [s + shift for s in self.seconds]
+            self.resumes = [s + shift for s in self.resumes]
+        if numpy:
+            self._arrays = tuple(numpy.array(a, dtype=float) for a in (
+                self.beats, self.seconds, self.stops, self.spb, self.resumes))
+
+    @classmethod
+    def from_simfile(cls, simfile, offset=True):
+        """
+        Build an engine from a simfile's BPMS and STOPS. If `offset` is true,
+        times are relative to the start of the music, otherwise to beat 0.
+        """
+        return cls(simfile['BPMS'], simfile.get('STOPS') or (),
+                   -float(simfile['OFFSET']) if offset else 0)
+
+    def _segment(self, beat):
+        return max(bisect_right(self.beats, beat) - 1, 0)
+
+    def seconds_at(self, beat):
+        """
+        Return the time at which the given beat is reached.
+        """
+        beat = float(beat)
+        i = self._segment(beat)
+        if beat > self.beats[i]:
+            return self.resumes[i] + (beat - self.beats[i]) * self.spb[i]
+        return self.seconds[i] + (beat - self.beats[i]) * self.spb[i]
+
+    def beat_at(self, seconds):
+        """
+        Return the beat at the given time. During a stop, this is the beat
+        the stop is on.
+        """
+        seconds = float(seconds)
+        i = max(bisect_right(self.seconds, seconds) - 1, 0)
+        if seconds < self.seconds[i]:
+            # Before the first event
+            return self.beats[i] + (seconds - self.seconds[i]) / self.spb[i]
+        if seconds <= self.resumes[i]:
+            return self.beats[i]
+        return self.beats[i] + (seconds - self.resumes[i]) / self.spb[i]
+
+    def seconds_between(self, start, end):
+        """
+        Return the time elapsed between two beats.
+        """
+        return self.seconds_at(end) - self.seconds_at(start)
+
+    def seconds_at_beats(self, beats):
+        """
+        Convert a sequence of beats to seconds. A NumPy array is converted in
+        one vectorized pass and returned as an array; anything else returns a
+        list, walking the segments in step with the beats when they're sorted.
+        """
+        if numpy and isinstance(beats, numpy.ndarray):
+            starts, seconds, stops, spb, resumes = self._arrays
+            beats = beats.astype(float)
+            i = numpy.maximum(numpy.searchsorted(starts, beats, 'right') - 1,
+                              0)
+            base = numpy.where(beats > starts[i], resumes[i], seconds[i])
+            return base + (beats - starts[i]) * spb[i]
+        beats = [float(beat) for beat in beats]
+        if any(b > a for a, b in zip(beats[1:], beats)):
+            return [self.seconds_at(beat) for beat in beats]
+        results = []
+        i = 0
+        last = len(self.beats) - 1
+        for beat in beats:
+            while i < last and self.beats[i + 1] <= beat:
+                i += 1
+            if beat > self.beats[i]:
+                results.append(self.resumes[i] +
+                               (beat - self.beats[i]) * self.spb[i])
+            else:
+                results.append(self.seconds[i] +
+                               (beat - self.beats[i]) * self.spb[i])
+        return results
+
+    def beats_at_seconds(self, seconds):
+        """
+        Convert a sequence of times to beats; the counterpart of
+        :meth:`seconds_at_beats`.
+        """
+        if numpy and isinstance(seconds, numpy.ndarray):
+            starts, starts_s, stops, spb, resumes = self._arrays
+            seconds = seconds.astype(float)
+            i = numpy.maximum(
+                numpy.searchsorted(starts_s, seconds, 'right') - 1, 0)
+            after = starts[i] + (seconds - resumes[i]) / spb[i]
+            before = starts[i] + (seconds - starts_s[i]) / spb[i]
+            return numpy.where(seconds < starts_s[i], before,
+                               numpy.where(seconds <= resumes[i], starts[i],
+                                           after))
+        return [self.beat_at(s) for s in seconds]
+
+
+    def bpms_at_beats(self, beats):
+        """
+        Return the BPM in effect at each of a sequence of beats, as an array
+        for a NumPy array and as a list otherwise.
+        """
+        if numpy and isinstance(beats, numpy.ndarray):
+            starts, seconds, stops, spb, resumes = self._arrays
+            i = numpy.maximum(numpy.searchsorted(starts, beats, 'right') - 1,
+                              0)
+            return 60. / spb[i]
+        return [60. / self.spb[self._segment(float(beat))] for beat in beats]
+
+    def preview(self, start, end, resolution=48):
+        """
+        Sample the timing every 1/`resolution` beats from `start` up to
+        `end` for plotting. Returns a dict of equal-length columns, which are
+        NumPy arrays if NumPy is available and lists otherwise:
+
+            * "beat" -- the beat of each sample
+            * "seconds" -- the time at which the beat is reached
+            * "bpm" -- the BPM in effect at the beat
+            * "effective_bpm" -- the average scroll speed from the beat to
+              the next sample, in beats per minute, which is lower than the
+              BPM wherever there's a stop
+        """
+        step = 1. / resolution
+        count = max(int(round((end - start) * resolution)), 0)
+        if numpy:
+            beats = start + numpy.arange(count + 1) * step
+            seconds = self.seconds_at_beats(beats)
+            with numpy.errstate(divide='ignore'):
+                effective = 60. * step / numpy.diff(seconds)
+            return {
+                'beat': beats[:-1],
+                'seconds': seconds[:-1],
+                'bpm': self.bpms_at_beats(beats[:-1]),
+                'effective_bpm': effective,
+            }
+        beats = [start + i * step for i in xrange(count + 1)]
+        seconds = self.seconds_at_beats(beats)
+        effective = []
+        for a, b in zip(seconds, seconds[1:]):
+            effective.append(60. * step / (b - a) if b != a else float('inf'))
+        return {
+            'beat': beats[:-1],
+            'seconds': seconds[:-1],
+            'bpm': self.bpms_at_beats(beats[:-1]),
+            'effective_bpm': effective,
+        }
+
+
+def _pick_bpm(spb, low, high):
+    """
+    Return a BPM, rounded to three decimal places, whose seconds per beat
+    is between `low` and `high` and as close to `spb` as rounding allows, or
+    None if there isn't one.
+    """
+    slack = 1e-12
+    candidates = [round(60. / spb, 3)]
+    if high > 0:
+        candidates.append(math.ceil(60. / high * 1000) / 1000)
+    if low > 0:
+        candidates.append(math.floor(60. / low * 1000) / 1000)
+    for bpm in candidates:
+        if bpm > 0 and low - slack <= 60. / bpm <= high + slack:
+            return Decimal('%.3f' % bpm)
+    return None
+
+def compact(bpms, stops=(), tolerance=.001, beats=None):
+    """
+    Rewrite BPMS and STOPS with as few events as possible. Returns a
+    (bpms, stops) pair of lists of (beat, value) pairs.
+
+    By default, every beat is reached within `tolerance` seconds of when the
+    original timing reaches it, so scroll effects look the same. If `beats`
+    is given (e.g. the beats of every note), only those beats are kept in
+    time, and anything between them may scroll differently.
+
+    Kept events keep their original beats and stops; new BPMs are rounded
+    to three decimal places, and the error that introduces is carried
+    forward, so it can't accumulate past `tolerance`. Raises ValueError for
+    negative (or zero) BPMs and negative stops, which the compaction can't
+    model.
+    """
+    if any(bpm <= 0 for beat, bpm in bpms) or \
+            any(stop < 0 for beat, stop in stops):
+        raise ValueError('negative BPMs and stops are not supported')
+    engine = TimingEngine(bpms, stops)
+    # Original beat, BPM (or None) and total stop for each of the engine's
+    # segments, in the same order
+    events = {}
+    for beat, bpm in bpms:
+        events.setdefault(float(beat), [beat, None, 0])[1] = bpm
+    for beat, stop in stops:
+        events.setdefault(float(beat), [beat, None, 0])[2] += stop
+    events = [events[beat] for beat in engine.beats]
+    # BPM in effect during each segment
+    bpm = min(bpms, key=lambda pair: float(pair[0]))[1]
+    active = []
+    for beat, event_bpm, stop in events:
+        if event_bpm is not None:
+            bpm = event_bpm
+        active.append(bpm)
+    # Beats to keep in time, as (beat, earliest time, latest time). Beats
+    # just before a stop are reached when it starts and beats just after it
+    # when it ends, but the new timing can't jump there unless the stop is
+    # kept, so a dropped stop's beat has to be reached no earlier than
+    # `tolerance` before the stop ends and no later than `tolerance` after it
+    # starts. That's impossible for stops longer than twice `tolerance`,
+    # which are always kept.
+    if beats is None:
+        points = [(beat, resume - tolerance, seconds + tolerance)
+                  for beat, seconds, resume in zip(engine.beats,
+                                                   engine.seconds,
+                                                   engine.resumes)]
+    else:
+        points = [(beat, seconds - tolerance, seconds + tolerance)
+                  for beat, seconds in zip(sorted(set(beats)),
+                      engine.seconds_at_beats(sorted(set(beats))))]
+    
+    # Greedily keep the event furthest from the last one kept that can be
+    # reached with a single BPM while staying within tolerance of every
+    # point in between. The seconds per beat from event j to the next kept
+    # event must fall in [low, high], which narrows with every point.
+    kept = []
+    last = len(engine.beats) - 1
+    j = 0
+    p = 0
+    resume = engine.resumes[0]
+    while True:
+        start = engine.beats[j]
+        while p < len(points) and points[p][0] <= start:
+            p += 1
+        low, high = 0., float('inf')
+        best = None
+        q = p
+        for m in xrange(j + 1, last + 1):
+            while q < len(points) and points[q][0] < engine.beats[m]:
+                beat, earliest, latest = points[q]
+                low = max(low, (earliest - resume) / (beat - start))
+                high = min(high, (latest - resume) / (beat - start))
+                q += 1
+            if low > high:
+                break
+            # The kept event itself has to start on time
+            span = engine.beats[m] - start
+            seconds = engine.seconds[m]
+            event_low = max(low, (seconds - tolerance - resume) / span)
+            event_high = min(high, (seconds + tolerance - resume) / span)
+            if event_low <= engine.spb[j] <= event_high:
+                # Keeping the current BPM is good enough
+                best = (m, active[j])
+            elif event_low <= event_high:
+                spb = min(max((seconds - resume) / span, event_low),
+                          event_high)
+                bpm = _pick_bpm(spb, event_low, event_high) if spb > 0 \
+                    else None
+                if bpm is not None:
+                    best = (m, bpm)
+        else:
+            # Could every remaining event be dropped?
+            for beat, earliest, latest in points[q:]:
+                low = max(low, (earliest - resume) / (beat - start))
+                high = min(high, (latest - resume) / (beat - start))
+            if j == last or low <= engine.spb[last] <= high:
+                kept.append((j, active[last]))
+                break
+        if best is None:
+            # Fall back to the original BPM, which keeps the error as is
+            best = (j + 1, active[j])
+        m, bpm = best
+        kept.append((j, bpm))
+        resume += (60. / float(bpm) * (engine.beats[m] - start) +
+                   float(events[m][2]))
+        j = m
+    
+    new_bpms = []
+    new_stops = []
+    for j, bpm in kept:
+        beat, event_bpm, stop = events[j]
+        if not new_bpms or bpm != new_bpms[-1][1]:
+            new_bpms.append((beat, bpm))
+        if stop:
+            new_stops.append((beat, stop))
+    return new_bpms, new_stops
@@ -1,39 +1,229 @@
+from fnmatch import fnmatch
 from inspect import isclass
-import glob
+import logging
 import os
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
 
 from synctools import settings
-from synctools.command import SynctoolsCommand
+from synctools.command import CommandSpec, SynctoolsCommand
 
-def get_commands():
+# Entry point group under which other packages can register commands
+ENTRY_POINT_GROUP = 'synctools.commands'
+
+def get_command_specs(entry_points=True):
     """
-    Get a mapping of commands' names to the command classes themselves.
+    Get a mapping of commands' names to CommandSpec objects describing them,
+    without importing the commands themselves.
+
+    Built-in commands are the modules listed in synctools.settings.COMMANDS,
+    as described by synctools.commands.manifest. Other packages can provide
+    commands through the "synctools.commands" entry point group, naming each
+    entry point after the command and pointing it at the command class::
 
-    Only modules defined in synctools.settings.COMMANDS are searched for
-    Command subclasses. Command names are their class names, not their `title`
-    attributes.
+        entry_points={
+            'synctools.commands': ['MyCommand = mypackage:MyCommand'],
+        }
+
+    Installed packages are only searched for entry points if `entry_points`
+    is true, and only once per process. Command names are their class names,
+    not their `title` attributes.
     """
-    if hasattr(get_commands, 'commands'):
-        return get_commands.commands
-    get_commands.commands = {}
-    for module in [__import__('synctools.commands.' + name, fromlist=name)
-                   for name in settings.COMMANDS]:
+    if not hasattr(get_command_specs, 'builtin'):
+        get_command_specs.builtin = _get_builtin_specs()
+    if not entry_points:
+        return get_command_specs.builtin
+    if not hasattr(get_command_specs, 'specs'):
+        specs = get_command_specs.specs = dict(get_command_specs.builtin)
+        for name, spec in _get_entry_point_specs():
+            if name not in specs:
+                specs[name] = spec
+    return get_command_specs.specs
+
+def _get_builtin_specs():
+    """
+    Get the specs of the commands listed in synctools.settings.COMMANDS.
+    """
+    from synctools.commands.manifest import manifest
+    specs = {}
+    for module_name in settings.COMMANDS:
+        if module_name in manifest:
+            spec = manifest[module_name]
+            specs[spec.name] = spec
+            continue
+        # Modules without a spec have to be searched for Command subclasses
+        module = __import__('synctools.commands.' + module_name,
+                            fromlist=module_name)
         for name, attr in module.__dict__.items():
             if (isclass(attr) and issubclass(attr, SynctoolsCommand) and
                     attr is not SynctoolsCommand):
-                get_commands.commands[name] = attr
-    return get_commands.commands
+                specs[name] = CommandSpec(name, module.__name__)
+    return specs
 
-def find_simfiles(path):
+def _get_entry_point_specs():
     """
-    Recursively search the given path for .sm files. Returns a list of paths.
+    Yield (name, spec) for each command registered under ENTRY_POINT_GROUP.
+    """
+    try:
+        import pkg_resources
+    except ImportError:
+        return
+    for entry_point in pkg_resources.iter_entry_points(ENTRY_POINT_GROUP):
+        # "MyCommand = mypackage" names a module, not a class; assume the
+        # class is named after the command
+        attribute = entry_point.attrs[0] if entry_point.attrs else None
+        yield entry_point.name, CommandSpec(
+            entry_point.name, entry_point.module_name, attribute=attribute)
+
+def get_commands():
+    """
+    Get a mapping of commands' names to the command classes themselves. This
+    imports every command; use get_command_specs where possible.
+    """
+    return dict((name, spec.load())
+                for name, spec in get_command_specs().items())
+
+def _list_dir(path):
+    """
+    Yield (name, path, is_dir) for each entry of a directory. Uses scandir
+    where available so that no extra stat call is needed per entry.
+    """
+    if scandir:
+        for entry in scandir(path):
+            yield entry.name, entry.path, entry.is_dir()
+    else:
+        for name in os.listdir(path):
+            child = os.path.join(path, name)
+            yield name, child, os.path.isdir(child)
+
+def _dir_key(path):
     """
+    Identify a directory independently of the symlinks used to reach it.
+    """
+    st = os.stat(path)
+    if st.st_ino:
+        return (st.st_dev, st.st_ino)
+    # Some platforms don't report inode numbers
+    return os.path.realpath(path)
+
+def _matches(relpath, patterns):
+    """
+    Check a path (relative to the search root) against a list of glob
+    patterns. Patterns containing a slash are matched against the whole
+    path; other patterns are matched against each component, so that e.g.
+    "DDR*" selects every pack whose name starts with DDR.
+    """
+    relpath = relpath.replace(os.sep, '/')
+    components = relpath.split('/')
+    for pattern in patterns:
+        if '/' in pattern:
+            if fnmatch(relpath, pattern):
+                return True
+        elif any(fnmatch(component, pattern) for component in components):
+            return True
+    return False
+
+def iter_simfiles(path, include=None, exclude=None, index=None):
+    """
+    Recursively search the given path for .sm files, yielding each path as
+    soon as it is found.
+
+    `include` and `exclude` are optional lists of glob patterns. Simfiles are
+    only yielded if they match at least one `include` pattern (when given);
+    files and directories matching any `exclude` pattern are skipped without
+    being searched. Directories reachable through more than one symlink are
+    only searched once.
+
+    If a SimfileIndex is given, `include` patterns are also matched against
+    the TITLE and ARTIST of simfiles whose paths don't match, as looked up
+    in the index, which only reads simfiles that have changed.
+    """
+    def wanted(relpath, filename):
+        if not include or _matches(relpath, include):
+            return True
+        if index:
+            try:
+                metadata = index.get(filename)
+            except (IOError, OSError, UnicodeDecodeError):
+                return False
+            finally:
+                # Don't hold the write lock while worker processes run
+                index.commit()
+            return any(fnmatch(metadata[key] or '', pattern)
+                       for key in ('TITLE', 'ARTIST')
+                       for pattern in include)
+        return False
+    
     if os.path.isfile(path):
-        if os.path.splitext(path)[1] == '.sm':
-            return [path]
-    elif os.path.isdir(path):
-        paths = []
-        for child in glob.iglob(os.path.join(path.replace('[', '[[]'), '*')):
-            paths.extend(find_simfiles(child))
-        return paths
-    return []
+        if (os.path.splitext(path)[1] == '.sm' and wanted(path, path) and
+                not (exclude and _matches(path, exclude))):
+            yield path
+        return
+    if not os.path.isdir(path):
+        return
+    
+    log = logging.getLogger('synctools')
+    visited = set([_dir_key(path)])
+    stack = [(path, '')]
+    while stack:
+        dirpath, reldir = stack.pop()
+        subdirs = []
+        try:
+            entries = list(_list_dir(dirpath))
+        except OSError, e:
+            # Unreadable or vanished directories are skipped, like os.walk
+            log.warning('Skipping %s: %s' % (dirpath, e.strerror or e))
+            continue
+        for name, child, is_dir in entries:
+            relpath = os.path.join(reldir, name)
+            if exclude and _matches(relpath, exclude):
+                continue
+            if is_dir:
+                try:
+                    key = _dir_key(child)
+                except OSError:
+                    # e.g. a broken symlink or a directory that just vanished
+                    continue
+                if key not in visited:
+                    visited.add(key)
+                    subdirs.append((child, relpath))
+            elif (os.path.splitext(name)[1] == '.sm' and
+                  wanted(relpath, child)):
+                yield child
+        # Search subdirectories in the order they were listed
+        stack.extend(reversed(subdirs))
+
+def find_simfiles(path, include=None, exclude=None, index=None):
+    """
+    Recursively search the given path for .sm files. Returns a list of paths.
+    See `iter_simfiles` for the meaning of the other arguments.
+    """
+    return list(iter_simfiles(path, include, exclude, index))
+
+def read_paths(stream, separator='\0', chunk_size=65536):
+    """
+    Yield the paths in a stream of separator-delimited paths, such as the
+    output of ``find -print0``, without waiting for the stream to end.
+    """
+    read = stream.read
+    if hasattr(stream, 'fileno'):
+        # file.read() blocks until the whole chunk is available
+        fd = stream.fileno()
+        read = lambda size: os.read(fd, size)
+    pending = ''
+    while True:
+        chunk = read(chunk_size)
+        if not chunk:
+            break
+        paths = (pending + chunk).split(separator)
+        pending = paths.pop()
+        for path in paths:
+            if path:
+                yield path
+    if pending:
+        yield pending
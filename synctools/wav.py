@@ -0,0 +1,107 @@
+"""
+Writing WAV files in 8-bit, 16-bit or floating point sample formats.
+
+The standard library's `wave` module only writes integer PCM, so the header
+is written by hand here. Samples are floats between -1 and 1, given either
+as a NumPy array or as any sequence of numbers.
+"""
+from array import array
+import struct
+import sys
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+__all__ = ['SAMPLE_FORMATS', 'WavWriter', 'encode']
+
+# Sample format name -> (WAVE format tag, bytes per sample)
+SAMPLE_FORMATS = {
+    '8': (1, 1),
+    '16': (1, 2),
+    'float': (3, 4),
+}
+
+def encode(samples, sample_format):
+    """
+    Clip the samples to [-1, 1] and return them as little-endian bytes in
+    the given sample format.
+    """
+    if numpy and isinstance(samples, numpy.ndarray):
+        samples = numpy.clip(samples, -1, 1)
+        if sample_format == '8':
+            return (samples * 127 + 128).astype(numpy.uint8).tostring()
+        elif sample_format == '16':
+            return (samples * 32767).astype('<i2').tostring()
+        return samples.astype('<f4').tostring()
+    samples = [min(max(sample, -1.), 1.) for sample in samples]
+    if sample_format == '8':
+        return str(bytearray(int(sample * 127 + 128) for sample in samples))
+    elif sample_format == '16':
+        data = array('h', (int(sample * 32767) for sample in samples))
+    else:
+        data = array('f', samples)
+    if sys.byteorder == 'big':
+        data.byteswap()
+    return data.tostring()
+
+
+class WavWriter(object):
+    """
+    Writes a mono or multichannel WAV file incrementally. The header's size
+    fields are filled in by :meth:`close`.
+    """
+
+    def __init__(self, filename, sample_rate=44100, sample_format='16',
+                 channels=1):
+        if sample_format not in SAMPLE_FORMATS:
+            raise ValueError('unknown sample format %r' % sample_format)
+        self.sample_format = sample_format
+        self.channels = channels
+        self.format_tag, self.sample_width = SAMPLE_FORMATS[sample_format]
+        self.frames = 0
+        self.file = open(filename, 'wb')
+        block_align = self.sample_width * channels
+        fmt = struct.pack('<HHIIHH', self.format_tag, channels, sample_rate,
+                          sample_rate * block_align, block_align,
+                          self.sample_width * 8)
+        self.file.write('RIFF\0\0\0\0WAVE')
+        if self.format_tag == 1:
+            self.file.write('fmt ' + struct.pack('<I', len(fmt)) + fmt)
+        else:
+            # Non-PCM formats have an extension size and a fact chunk
+            fmt += struct.pack('<H', 0)
+            self.file.write('fmt ' + struct.pack('<I', len(fmt)) + fmt)
+            self.file.write('fact' + struct.pack('<I', 4))
+            self.fact_position = self.file.tell()
+            self.file.write('\0\0\0\0')
+        self.file.write('data\0\0\0\0')
+        self.data_position = self.file.tell()
+
+    def writeframes(self, data):
+        """
+        Append encoded sample data (see :func:`encode`).
+        """
+        self.file.write(data)
+        self.frames += len(data) // (self.sample_width * self.channels)
+
+    def writesamples(self, samples):
+        """
+        Encode and append float samples.
+        """
+        self.writeframes(encode(samples, self.sample_format))
+
+    def close(self):
+        data_size = self.file.tell() - self.data_position
+        if data_size % 2:
+            # Chunks are padded to an even length
+            self.file.write('\0')
+        riff_size = self.file.tell() - 8
+        self.file.seek(4)
+        self.file.write(struct.pack('<I', riff_size))
+        if self.format_tag != 1:
+            self.file.seek(self.fact_position)
+            self.file.write(struct.pack('<I', self.frames))
+        self.file.seek(self.data_position - 4)
+        self.file.write(struct.pack('<I', data_size))
+        self.file.close()
@@ -0,0 +1,4 @@
+import logging
+
+# Commands log through the "synctools" logger; keep test output quiet
+logging.getLogger('synctools').addHandler(logging.NullHandler())
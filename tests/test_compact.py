@@ -0,0 +1,71 @@
+from decimal import Decimal
+import random
+import unittest
+
+from synctools.timing import TimingEngine, compact
+from tests.test_timing import random_timing
+
+
+class TestCompact(unittest.TestCase):
+
+    def assertWithinTolerance(self, bpms, stops, new_bpms, new_stops,
+                              tolerance, beats):
+        original = TimingEngine(bpms, stops)
+        compacted = TimingEngine(new_bpms, new_stops)
+        slack = 1e-9
+        for beat in beats:
+            # A beat on a stop may be reached any time during the stop
+            i = original._segment(beat)
+            earliest = latest = original.seconds_at(beat)
+            if original.beats[i] == beat:
+                latest = original.resumes[i]
+            seconds = compacted.seconds_at(beat)
+            self.assertTrue(
+                earliest - tolerance - slack <= seconds <=
+                latest + tolerance + slack,
+                'beat %s at %s, expected %s-%s' % (beat, seconds, earliest,
+                                                   latest))
+
+    def test_every_beat_within_tolerance(self):
+        rng = random.Random(3)
+        for tolerance in (.0005, .001, .01):
+            bpms, stops = random_timing(rng)
+            new_bpms, new_stops = compact(bpms, stops, tolerance)
+            self.assertTrue(len(new_bpms) + len(new_stops) <
+                            len(bpms) + len(stops))
+            events = set(float(beat) for beat, value in bpms + stops)
+            samples = set(i / 8. for i in xrange(int(max(events) * 8) + 32))
+            self.assertWithinTolerance(bpms, stops, new_bpms, new_stops,
+                                       tolerance, sorted(events | samples))
+
+    def test_notes_within_tolerance(self):
+        rng = random.Random(4)
+        bpms, stops = random_timing(rng)
+        last = int(max(float(beat) for beat, value in bpms + stops))
+        notes = sorted(set(rng.randrange(last * 4) / 4. for i in xrange(300)))
+        new_bpms, new_stops = compact(bpms, stops, .001, beats=notes)
+        self.assertWithinTolerance(bpms, stops, new_bpms, new_stops, .001,
+                                   notes)
+
+    def test_only_short_stops_dropped(self):
+        bpms = [(Decimal(0), Decimal(120)), (Decimal(8), Decimal(120))]
+        stops = [(Decimal(4), Decimal('0.0015')), (Decimal(6), Decimal('0.5'))]
+        new_bpms, new_stops = compact(bpms, stops, .001)
+        self.assertEqual(new_stops, [(Decimal(6), Decimal('0.5'))])
+        self.assertWithinTolerance(bpms, stops, new_bpms, new_stops, .001,
+                                   [i / 4. for i in xrange(40)])
+
+    def test_values_rounded(self):
+        bpms, stops = random_timing(random.Random(5))
+        new_bpms, new_stops = compact(bpms, stops, .001)
+        for beat, bpm in new_bpms:
+            self.assertEqual(Decimal(bpm), Decimal('%.3f' % bpm))
+        self.assertEqual(new_bpms[0][0], 0)
+
+    def test_rejects_negative_timing(self):
+        self.assertRaises(ValueError, compact, [(0, 120), (4, -120)])
+        self.assertRaises(ValueError, compact, [(0, 120)], [(4, -1)])
+
+
+if __name__ == '__main__':
+    unittest.main()
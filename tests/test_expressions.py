@@ -0,0 +1,39 @@
+import unittest
+
+from synctools.commands.gimmickbuilder_versions.expressions import (
+    Expression, ExpressionError, compile_expression)
+
+
+class TestExpressions(unittest.TestCase):
+
+    def test_evaluate(self):
+        self.assertEqual(Expression('bpm * mul')(bpm=120, mul=2, len=1), 240)
+        self.assertAlmostEqual(
+            Expression('60 / (bpm * mul) * ((mul - 1) * len)')(
+                bpm=150., mul=2., len=.5),
+            .1)
+        self.assertEqual(Expression(' -bpm + +1 ')(bpm=3, mul=0, len=0), -2)
+
+    def test_integer_division(self):
+        # Gimmick definitions have always used Python 2 division
+        self.assertEqual(Expression('bpm / 2')(bpm=5, mul=1, len=1), 2)
+
+    def test_numbers(self):
+        self.assertEqual(Expression(120)(bpm=0, mul=0, len=0), 120)
+
+    def test_rejected(self):
+        for source in ('__import__("os")', 'bpm.real', 'bpm ** 2',
+                       'bpm if mul else len', '[bpm]', 'lambda: 1',
+                       'foo * 2', '1j', 'bpm % 2', 'bpm, mul', 'bpm *'):
+            self.assertRaises(ExpressionError, Expression, source)
+
+    def test_error_is_value_error(self):
+        self.assertTrue(issubclass(ExpressionError, ValueError))
+
+    def test_cached(self):
+        self.assertIs(compile_expression('bpm * 3'),
+                      compile_expression('bpm * 3'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+import codecs
+import os
+import shutil
+import tempfile
+import unittest
+
+from synctools.journal import Journal, header_tags, replace_tag
+
+SIMFILE = u"""#TITLE:Ünïcödé Song;
+#ARTIST:Someone;
+#OFFSET:-0.123;
+#BPMS:0.000=150.000,
+32.000=300.000;
+#STOPS:16.000=0.250;
+
+//---------------dance-single - ----------------
+#NOTES:
+     dance-single:
+     :
+     Challenge:
+     10:
+     0,0,0,0,0:
+1000
+0100
+0010
+0001
+;
+"""
+
+
+class TestJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.journal = Journal(os.path.join(self.directory, 'journal.jsonl'))
+        self.simfile = os.path.join(self.directory, 'song.sm')
+        with codecs.open(self.simfile, 'w', encoding='utf-8') as sm:
+            sm.write(SIMFILE)
+        with open(self.simfile, 'rb') as sm:
+            self.original = sm.read()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def edit(self, run_id, tags):
+        """
+        Change the simfile's tags the way a command's save() would, and
+        journal their previous values.
+        """
+        with codecs.open(self.simfile, 'r', encoding='utf-8') as sm:
+            text = sm.read()
+        old_tags = header_tags(text)
+        for tag, value in tags.items():
+            text = replace_tag(text, tag, value)
+        with codecs.open(self.simfile, 'w', encoding='utf-8') as sm:
+            sm.write(text)
+        self.journal.record(run_id, 'Test', self.simfile,
+                            dict((tag, old_tags.get(tag)) for tag in tags))
+
+    def read(self):
+        with open(self.simfile, 'rb') as sm:
+            return sm.read()
+
+    def test_header_tags(self):
+        tags = header_tags(SIMFILE)
+        self.assertEqual(tags['OFFSET'], '-0.123')
+        self.assertEqual(tags['BPMS'], '0.000=150.000,\n32.000=300.000')
+        self.assertNotIn('NOTES', tags)
+
+    def test_undo_restores_original_bytes(self):
+        self.edit('run-1', {'OFFSET': '-0.100', 'BPMS': '0.000=151.000',
+                            'DISPLAYBPM': '150'})
+        self.assertNotEqual(self.read(), self.original)
+        self.journal.undo('run-1')
+        self.assertEqual(self.read(), self.original)
+
+    def test_undo_is_journaled(self):
+        self.edit('run-1', {'OFFSET': '-0.100'})
+        edited = self.read()
+        undo_id = self.journal.undo('run-1')
+        self.journal.undo(undo_id)
+        self.assertEqual(self.read(), edited)
+        runs = self.journal.runs()
+        self.assertEqual([run[0] for run in runs],
+                         ['run-1', undo_id, runs[2][0]])
+
+    def test_undo_only_touches_its_run(self):
+        self.edit('run-1', {'OFFSET': '-0.100'})
+        self.edit('run-2', {'STOPS': '16.000=0.251'})
+        self.journal.undo('run-1')
+        tags = header_tags(self.read().decode('utf-8'))
+        self.assertEqual(tags['OFFSET'], '-0.123')
+        self.assertEqual(tags['STOPS'], '16.000=0.251')
+
+    def test_undo_bytes(self):
+        data = self.read()
+        with open(self.simfile, 'r+b') as patched:
+            self.journal.record_bytes('run-1', 'Test', self.simfile, 10,
+                                      data[10:20])
+            patched.seek(10)
+            patched.write('\xff' * 10)
+        self.journal.undo('run-1')
+        self.assertEqual(self.read(), self.original)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+from fractions import Fraction
+import unittest
+
+from synctools import notes
+from synctools.notes import HEADS, HOLD, MINE, NoteIndex, TAIL, TAP
+
+NOTES = [
+    (Fraction(0), '1000'),
+    (Fraction(1, 2), '0200'),
+    (Fraction(1), 'M001'),
+    (Fraction(3, 2), '0300'),
+    (Fraction(2), '00M'),
+    (Fraction(4), '0000'),
+]
+
+
+class TestNoteIndex(unittest.TestCase):
+
+    def check(self):
+        index = NoteIndex(NOTES)
+        self.assertEqual(len(index), 6)
+        self.assertEqual(index.columns, 4)
+        self.assertEqual(list(index.rows_with(TAP)), [0, 2])
+        self.assertEqual(list(index.beats_with(MINE)), [1., 2.])
+        self.assertEqual(list(index.beats_with(HEADS)), [0., .5, 1.])
+        self.assertEqual(index.count(HEADS), 3)
+        self.assertEqual(index.count(TAIL), 1)
+        self.assertEqual(list(index.column(1)), [0, HOLD, 0, TAIL, 0, 0])
+        # The short row is padded with empty columns
+        self.assertEqual(list(index.column(3)), [0, 0, TAP, 0, 0, 0])
+        self.assertEqual(index.last_beat, 4.)
+
+    def test_index(self):
+        self.check()
+
+    def test_index_without_numpy(self):
+        if not notes.numpy:
+            return
+        numpy, notes.numpy = notes.numpy, None
+        try:
+            self.check()
+        finally:
+            notes.numpy = numpy
+
+    def test_empty(self):
+        index = NoteIndex([])
+        self.assertEqual(len(index), 0)
+        self.assertEqual(index.count(HEADS), 0)
+        self.assertEqual(index.last_beat, 0.)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+import os
+import random
+import shutil
+import struct
+import tempfile
+import unittest
+
+from synctools.commands.manifest import manifest
+from synctools.commands.patch import Patch
+from synctools.journal import Journal
+
+
+def ogg_crc(data):
+    """
+    The OGG page checksum: CRC-32 with polynomial 0x04c11db7, computed
+    MSB-first with no reflection, initial value or final XOR.
+    """
+    crc = 0
+    for byte in bytearray(data):
+        crc ^= byte << 24
+        for i in xrange(8):
+            if crc & 0x80000000:
+                crc = ((crc << 1) ^ 0x04c11db7) & 0xffffffff
+            else:
+                crc = (crc << 1) & 0xffffffff
+    return crc
+
+
+def ogg_page(rng, sequence, granule, flags, size):
+    """
+    Build an OGG page with `size` bytes of payload and a valid checksum.
+    """
+    payload = ''.join(chr(rng.randrange(256)) for i in xrange(size))
+    # Avoid accidental capture patterns in the payload
+    payload = payload.replace('OggS', 'Ogg_')
+    lacing = [255] * (size // 255) + [size % 255]
+    header = ('OggS\x00' + chr(flags) + struct.pack('<qII', granule, 1,
+                                                    sequence))
+    segments = chr(len(lacing)) + ''.join(chr(value) for value in lacing)
+    crc = ogg_crc(header + '\x00' * 4 + segments + payload)
+    return header + struct.pack('<I', crc) + segments + payload
+
+
+def granule_and_crc(page):
+    return struct.unpack('<q', page[6:14])[0], struct.unpack('<I',
+                                                             page[22:26])[0]
+
+
+class FakeSimfile(dict):
+    # Patch only needs the simfile's filename and MUSIC tag
+
+    def __init__(self, filename, **tags):
+        super(FakeSimfile, self).__init__(tags)
+        self.filename = filename
+
+
+class TestPatch(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.ogg = os.path.join(self.directory, 'song.ogg')
+        self.simfile = FakeSimfile(os.path.join(self.directory, 'song.sm'),
+                                   TITLE='Song', MUSIC='song.ogg')
+        self.patch = Patch(dict((field['name'], field['default'])
+                                for field in manifest['patch'].fields))
+        self.patch.journal = Journal(os.path.join(self.directory,
+                                                  'journal.jsonl'))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_ogg(self, sizes):
+        """
+        Write an OGG file with one page per size, the last of which has the
+        end-of-stream flag set, and return its pages.
+        """
+        rng = random.Random(len(sizes))
+        pages = []
+        for sequence, size in enumerate(sizes):
+            last = sequence == len(sizes) - 1
+            pages.append(ogg_page(rng, sequence, (sequence + 1) * 44100 * 10,
+                                  4 if last else 0, size))
+        with open(self.ogg, 'wb') as ogg:
+            ogg.write(''.join(pages))
+        return pages
+
+    def read(self):
+        with open(self.ogg, 'rb') as ogg:
+            return ogg.read()
+
+    def check_patched(self, pages):
+        data = self.read()
+        self.assertEqual(len(data), sum(len(page) for page in pages))
+        last_start = len(data) - len(pages[-1])
+        # Earlier pages are left alone
+        self.assertEqual(data[:last_start], ''.join(pages[:-1]))
+        last = data[last_start:]
+        granule, crc = granule_and_crc(last)
+        self.assertEqual(granule, self.patch.options['length'] * 44100)
+        self.assertEqual(crc, ogg_crc(last[:22] + '\x00' * 4 + last[26:]))
+        # Only the granule position and checksum change
+        self.assertEqual(last[:6], pages[-1][:6])
+        self.assertEqual(last[14:22], pages[-1][14:22])
+        self.assertEqual(last[26:], pages[-1][26:])
+
+    def test_generated_pages_are_valid(self):
+        for page in self.write_ogg([100, 5000]):
+            self.assertEqual(granule_and_crc(page)[1],
+                             ogg_crc(page[:22] + '\x00' * 4 + page[26:]))
+
+    def test_multiple_pages(self):
+        pages = self.write_ogg([4000, 4000, 4000, 1000])
+        self.patch.run(self.simfile)
+        self.check_patched(pages)
+
+    def test_last_page_spans_blocks(self):
+        # A last page larger than Patch's read block, made of many segments
+        pages = self.write_ogg([3000, 3000, 3 * Patch.block_size])
+        self.patch.run(self.simfile)
+        self.check_patched(pages)
+
+    def test_single_short_page(self):
+        pages = self.write_ogg([40])
+        self.patch.run(self.simfile)
+        self.check_patched(pages)
+
+    def test_largest_page(self):
+        pages = self.write_ogg([1000, 255 * 255 - 1])
+        self.patch.run(self.simfile)
+        self.check_patched(pages)
+
+    def test_undo(self):
+        self.write_ogg([4000, 4000, 1000])
+        original = self.read()
+        self.patch.run(self.simfile)
+        self.assertNotEqual(self.read(), original)
+        self.patch.journal.undo(self.patch.run_id)
+        self.assertEqual(self.read(), original)
+
+    def test_no_last_page(self):
+        with open(self.ogg, 'wb') as ogg:
+            ogg.write('not an ogg file' * 100)
+        self.patch.run(self.simfile)
+        self.assertEqual(self.read(), 'not an ogg file' * 100)
+
+
+if __name__ == '__main__':
+    unittest.main()
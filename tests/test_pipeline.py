@@ -0,0 +1,43 @@
+import unittest
+
+from synctools import command
+from synctools.pipeline import Pipeline
+
+
+class Tagger(command.SynctoolsCommand):
+    fields = [command.common_fields['backup']]
+
+
+class Patcher(command.SynctoolsCommand):
+    fields = [{
+        'name': 'backup_audio',
+        'title': 'Back up audio files?',
+        'input': command.FieldInputs.boolean,
+        'default': True,
+        'type': command.FieldTypes.yesno,
+    }]
+
+
+class TestPipeline(unittest.TestCase):
+
+    def pipeline(self, backup=False, backup_audio=False):
+        return Pipeline([(Tagger, {'backup': backup}),
+                         (Patcher, {'backup_audio': backup_audio})])
+
+    def test_members_share_run_id(self):
+        pipeline = self.pipeline()
+        for command_instance in pipeline.commands:
+            self.assertEqual(command_instance.run_id, pipeline.run_id)
+        # As in a worker process, which journals under the parent's ID
+        pipeline.run_id = 'parent'
+        for command_instance in pipeline.commands:
+            self.assertEqual(command_instance.run_id, 'parent')
+
+    def test_journaling(self):
+        self.assertFalse(self.pipeline().journaling)
+        self.assertTrue(self.pipeline(backup=True).journaling)
+        self.assertTrue(self.pipeline(backup_audio=True).journaling)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+from decimal import Decimal
+import random
+import unittest
+
+from synctools.timing import TimingEngine, from_ticks, to_ticks
+
+
+def baseline_seconds_between_beats(bpms, stops, start, end):
+    """
+    ClickTrack's original walk over every timing event, kept here as the
+    reference that TimingEngine has to agree with.
+    """
+    timing_events = [('bpm', float(t), float(v)) for t, v in bpms]
+    timing_events += [('stop', float(t), float(v)) for t, v in stops]
+    timing_events.sort(key=lambda item: item[1])
+    bpm = [float(v) for t, v in bpms if float(t) <= start][-1]
+    pos = start
+    seconds = 0.
+    for event, t, value in timing_events:
+        if start <= t < end:
+            seconds += 60 / bpm * (t - pos)
+            if event == 'stop':
+                seconds += value
+            elif event == 'bpm':
+                bpm = value
+            pos = t
+        elif t >= end:
+            break
+    seconds += 60 / bpm * (end - pos)
+    return seconds
+
+
+def random_timing(rng, events=200, gimmicky=True):
+    """
+    Generate BPMS and STOPS as lists of (beat, value) Decimal pairs, like a
+    simfile's. Gimmicky timing alternates between a handful of nearly equal
+    or doubled BPMs and has plenty of short stops.
+    """
+    bpms = [(Decimal('0.000'), Decimal('150.000'))]
+    stops = []
+    beat = 0
+    for i in xrange(events):
+        beat += rng.choice((1, 2, 3, 4, 6, 8)) * 12
+        position = Decimal(beat) / 48
+        if rng.random() < .3:
+            stops.append((position, Decimal('%.3f' % (rng.random() / 4))))
+        elif gimmicky:
+            bpms.append((position, Decimal(rng.choice(
+                ('150.000', '150.001', '149.999', '300.000', '75.000')))))
+        else:
+            bpms.append((position, Decimal('%.3f' % rng.uniform(60, 300))))
+    return bpms, stops
+
+
+class TestTimingEngine(unittest.TestCase):
+
+    def test_agrees_with_baseline(self):
+        rng = random.Random(0)
+        for gimmicky in (True, False):
+            bpms, stops = random_timing(rng, gimmicky=gimmicky)
+            engine = TimingEngine(bpms, stops)
+            last = float(max(bpms[-1][0], stops[-1][0])) + 4
+            for i in xrange(500):
+                start = rng.uniform(0, last)
+                end = rng.uniform(start, last)
+                if rng.random() < .2:
+                    # Land exactly on an event
+                    start = float(rng.choice(bpms + stops)[0])
+                    end = max(end, start)
+                self.assertAlmostEqual(
+                    engine.seconds_between(start, end),
+                    baseline_seconds_between_beats(bpms, stops, start, end),
+                    places=9)
+
+    def test_events_before_beat_zero(self):
+        bpms = [(-4, 60), (0, 120)]
+        stops = [(-1, .5), (2, .25)]
+        engine = TimingEngine(bpms, stops, offset=3)
+        self.assertEqual(engine.seconds_at(0), 3.)
+        self.assertEqual(engine.seconds_at(-1), 1.5)
+        self.assertEqual(engine.seconds_at(-4), -1.5)
+        self.assertEqual(engine.beat_at(3), 0.)
+        for end in (0, 1, 2, 2.5, 6):
+            self.assertAlmostEqual(
+                engine.seconds_between(0, end),
+                baseline_seconds_between_beats(bpms, stops, 0, end),
+                places=9)
+        self.assertEqual(TimingEngine([(0, 120)], [(-1, .5)]).seconds_at(0),
+                         0.)
+
+    def test_round_trip(self):
+        bpms, stops = random_timing(random.Random(1))
+        engine = TimingEngine(bpms, stops, offset=-.5)
+        for beat in (0, 1.5, 17, 100.25, 345):
+            self.assertAlmostEqual(
+                engine.beat_at(engine.seconds_at(beat)), beat, places=9)
+
+    def test_stop_delays_later_beats(self):
+        engine = TimingEngine([(0, 120)], [(4, 1)])
+        self.assertAlmostEqual(engine.seconds_at(4), 2)
+        self.assertAlmostEqual(engine.seconds_at(5), 3.5)
+        self.assertAlmostEqual(engine.beat_at(2.5), 4)
+
+    def test_vectorized_matches_scalar(self):
+        bpms, stops = random_timing(random.Random(2))
+        engine = TimingEngine(bpms, stops)
+        beats = [i / 4. for i in xrange(1000)]
+        for beat, seconds in zip(beats, engine.seconds_at_beats(beats)):
+            self.assertAlmostEqual(seconds, engine.seconds_at(beat),
+                                   places=9)
+
+
+class TestTicks(unittest.TestCase):
+
+    def test_round_trip(self):
+        for ticks in (0, 1, 47, 48, 12345):
+            self.assertEqual(to_ticks(from_ticks(ticks)), ticks)
+
+    def test_quantizes_to_192nds(self):
+        self.assertEqual(to_ticks(1), 48)
+        self.assertEqual(to_ticks(1. / 48 * .6), 1)
+        self.assertEqual(to_ticks(Decimal('0.333')), 16)
+        self.assertEqual(from_ticks(16), Decimal('0.333'))
+
+
+if __name__ == '__main__':
+    unittest.main()
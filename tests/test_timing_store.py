@@ -0,0 +1,77 @@
+from decimal import Decimal
+import unittest
+
+from synctools.commands.gimmickbuilder_versions.timing_store import \
+    TimingStore
+
+
+class TestTimingStore(unittest.TestCase):
+
+    def test_in_order(self):
+        store = TimingStore()
+        store.add('BPMS', 0, 120)
+        store.add('BPMS', 4, 240)
+        store.add('STOPS', 2, .5)
+        self.assertEqual(len(store), 3)
+        self.assertEqual(store.range('BPMS', 0, 10),
+                         [(Decimal('0.000'), 120.), (Decimal('4.000'), 240.)])
+        self.assertEqual(store.last('STOPS'), (Decimal('2.000'), .5))
+
+    def test_out_of_order_and_replaced(self):
+        store = TimingStore()
+        store.add('BPMS', 8, 180)
+        store.add('BPMS', 0, 120)
+        store.add('BPMS', 4, 240)
+        store.add('BPMS', 8, 200)
+        # Positions closer together than a 192nd note are the same position
+        store.add('BPMS', 4.001, 250)
+        self.assertEqual(len(store), 3)
+        self.assertEqual(store.range_ticks('BPMS', 0, 100),
+                         [(0, 120.), (192, 250.), (384, 200.)])
+        self.assertEqual(store.last('BPMS'), (Decimal('8.000'), 200.))
+
+    def test_range_is_half_open(self):
+        store = TimingStore()
+        for beat in xrange(10):
+            store.add('STOPS', beat, beat / 10.)
+        self.assertEqual([beat for beat, value in store.range('STOPS', 2, 5)],
+                         [2, 3, 4])
+
+    def test_copy(self):
+        store = TimingStore()
+        store.add('BPMS', 0, 120)
+        store.add('BPMS', 1, 240)
+        store.add('STOPS', 1.5, .25)
+        store.add('BPMS', 2, 120)
+        store.copy(0, 2, 8)
+        self.assertEqual(store.range('BPMS', 8, 10),
+                         [(Decimal('8.000'), 120.), (Decimal('9.000'), 240.)])
+        self.assertEqual(store.range('STOPS', 8, 10),
+                         [(Decimal('9.500'), .25)])
+
+    def test_events_round_and_drop_repeated_bpms(self):
+        store = TimingStore()
+        store.add('BPMS', 0, 120.0001)
+        store.add('BPMS', 1, 119.9999)
+        store.add('BPMS', 2, 150)
+        store.add('STOPS', 1, 1. / 3)
+        self.assertEqual(store.events('BPMS'), [
+            (Decimal('0.000'), Decimal('120.000')),
+            (Decimal('2.000'), Decimal('150.000')),
+        ])
+        self.assertEqual(store.events('STOPS'), [
+            (Decimal('1.000'), Decimal('0.333')),
+        ])
+
+    def test_record(self):
+        store = TimingStore(record=True)
+        store.add('BPMS', 4, 240)
+        store.add('BPMS', 0, 120)
+        replay = TimingStore()
+        for event in store.log:
+            replay.add_ticks(*event)
+        self.assertEqual(replay.events('BPMS'), store.events('BPMS'))
+
+
+if __name__ == '__main__':
+    unittest.main()
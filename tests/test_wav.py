@@ -0,0 +1,99 @@
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+import wave
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from synctools import wav
+
+SAMPLES = [0., .5, -.5, 1., -1., 2., -2.]
+
+
+class TestEncode(unittest.TestCase):
+
+    def test_8_bit(self):
+        self.assertEqual(bytearray(wav.encode(SAMPLES, '8')),
+                         bytearray([128, 191, 64, 255, 1, 255, 1]))
+
+    def test_16_bit(self):
+        self.assertEqual(
+            struct.unpack('<7h', wav.encode(SAMPLES, '16')),
+            (0, 16383, -16383, 32767, -32767, 32767, -32767))
+
+    def test_float(self):
+        self.assertEqual(struct.unpack('<7f', wav.encode(SAMPLES, 'float')),
+                         (0., .5, -.5, 1., -1., 1., -1.))
+
+    @unittest.skipUnless(numpy, 'NumPy is not installed')
+    def test_numpy_matches(self):
+        for sample_format in wav.SAMPLE_FORMATS:
+            self.assertEqual(
+                wav.encode(numpy.array(SAMPLES), sample_format),
+                wav.encode(SAMPLES, sample_format))
+
+
+class TestWavWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'out.wav')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, sample_format, chunks, **kwargs):
+        writer = wav.WavWriter(self.filename, sample_format=sample_format,
+                               **kwargs)
+        for chunk in chunks:
+            writer.writesamples(chunk)
+        writer.close()
+        with open(self.filename, 'rb') as written:
+            return written.read()
+
+    def test_pcm_readable_by_wave(self):
+        for sample_format, width in (('8', 1), ('16', 2)):
+            self.write(sample_format, [SAMPLES, SAMPLES[:3]],
+                       sample_rate=22050)
+            reader = wave.open(self.filename)
+            self.assertEqual(reader.getsampwidth(), width)
+            self.assertEqual(reader.getframerate(), 22050)
+            self.assertEqual(reader.getnchannels(), 1)
+            self.assertEqual(reader.getnframes(), 10)
+            self.assertEqual(reader.readframes(10),
+                             wav.encode(SAMPLES + SAMPLES[:3], sample_format))
+            reader.close()
+
+    def test_odd_data_is_padded(self):
+        data = self.write('8', [SAMPLES])
+        riff_size, = struct.unpack('<I', data[4:8])
+        self.assertEqual(riff_size, len(data) - 8)
+        self.assertEqual(len(data) % 2, 0)
+        data_size, = struct.unpack('<I', data[40:44])
+        self.assertEqual(data_size, len(SAMPLES))
+
+    def test_float_header(self):
+        data = self.write('float', [SAMPLES], channels=1)
+        self.assertEqual(data[:4], 'RIFF')
+        self.assertEqual(data[8:16], 'WAVEfmt ')
+        fmt_size, format_tag, channels, sample_rate, byte_rate, block_align, \
+            bits = struct.unpack('<IHHIIHH', data[16:36])
+        self.assertEqual((fmt_size, format_tag, bits), (18, 3, 32))
+        self.assertEqual(byte_rate, sample_rate * 4)
+        fact = data[38:50]
+        self.assertEqual(fact[:8], 'fact' + struct.pack('<I', 4))
+        self.assertEqual(struct.unpack('<I', fact[8:])[0], len(SAMPLES))
+        self.assertEqual(data[50:54], 'data')
+        self.assertEqual(data[58:], wav.encode(SAMPLES, 'float'))
+
+    def test_unknown_format(self):
+        self.assertRaises(ValueError, wav.WavWriter, self.filename,
+                          sample_format='24')
+
+
+if __name__ == '__main__':
+    unittest.main()